@@ -8,16 +8,15 @@ from util.rnd_util import *
 from util.rnd_util import _random_choice
 
 
-def create_env_gem_exit(
+def create_env_gem_exit_array(
     size: int = 10,
     num_gems: int = 0,
     seed: int = 0,
     num_rooms: int = 0,
     room_size: int = 6,
     ratio_gems_in_room: float = 0,
-    exit_in_room: bool = False,
-    max_steps: int = 9999
-):
+    exit_in_room: bool = False
+) -> np.ndarray:
     # Empty map
     rng = np.random.default_rng(seed)
     m = create_empty_map(size, gen=rng)
@@ -69,6 +68,28 @@ def create_env_gem_exit(
         add_item_inside_room(m, HiddenCellType.kExitClosed if num_gems > 0 else HiddenCellType.kExitOpen, blocked_tiles=blocked_idxs, gen=rng)
     add_item_inside_room(m, HiddenCellType.kAgent, blocked_tiles=blocked_idxs, gen=rng)
 
+    return m
+
+
+def create_env_gem_exit(
+    size: int = 10,
+    num_gems: int = 0,
+    seed: int = 0,
+    num_rooms: int = 0,
+    room_size: int = 6,
+    ratio_gems_in_room: float = 0,
+    exit_in_room: bool = False,
+    max_steps: int = 9999
+):
+    m = create_env_gem_exit_array(
+        size=size,
+        num_gems=num_gems,
+        seed=seed,
+        num_rooms=num_rooms,
+        room_size=room_size,
+        ratio_gems_in_room=ratio_gems_in_room,
+        exit_in_room=exit_in_room,
+    )
     return map_to_str(m, max_steps=max_steps, num_gems=num_gems)
 
 
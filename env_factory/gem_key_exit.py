@@ -15,7 +15,7 @@ from util.rnd_util import _random_choice
 
 MAX_ROOMS = 4
 
-def create_gem_key_exit(
+def create_gem_key_exit_array(
     size: int = 10,
     num_gems: int = 0,
     seed: int = 0,
@@ -25,9 +25,8 @@ def create_gem_key_exit(
     num_keys_in_main: int = 0,
     ratio_gems_in_room: float = 0,
     keys_in_order: bool = True,
-    exit_in_open: bool = False,
-    max_steps: int = 9999
-):
+    exit_in_open: bool = False
+) -> np.ndarray:
     # Empty map
     rng = np.random.default_rng(seed)
     m = create_empty_map(size, gen=rng)
@@ -99,6 +98,34 @@ def create_gem_key_exit(
     # Place agent inside main
     add_item_inside_room(m, HiddenCellType.kAgent, blocked_tiles=blocked_idxs, gen=rng)
 
+    return m
+
+
+def create_gem_key_exit(
+    size: int = 10,
+    num_gems: int = 0,
+    seed: int = 0,
+    num_rooms: int = 0,
+    room_size: int = 6,
+    num_locked_doors: int = 0,
+    num_keys_in_main: int = 0,
+    ratio_gems_in_room: float = 0,
+    keys_in_order: bool = True,
+    exit_in_open: bool = False,
+    max_steps: int = 9999
+):
+    m = create_gem_key_exit_array(
+        size=size,
+        num_gems=num_gems,
+        seed=seed,
+        num_rooms=num_rooms,
+        room_size=room_size,
+        num_locked_doors=num_locked_doors,
+        num_keys_in_main=num_keys_in_main,
+        ratio_gems_in_room=ratio_gems_in_room,
+        keys_in_order=keys_in_order,
+        exit_in_open=exit_in_open,
+    )
     return map_to_str(m, max_steps=max_steps, num_gems=num_gems)
 
 
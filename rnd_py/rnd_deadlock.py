@@ -0,0 +1,265 @@
+import sys
+import os
+import numpy as np
+from typing import List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game_util import *
+from rnd_py.rnd_game import RNDGameState
+from rnd_py.rnd_structure import MapStructure, get_map_structure
+
+# Closed gate and key of each colour, collecting a key opens every gate of its colour
+kGateKeyCellTypes = [
+    (kCellGateRedClosed, kCellKeyRed),
+    (kCellGateBlueClosed, kCellKeyBlue),
+    (kCellGateGreenClosed, kCellKeyGreen),
+    (kCellGateYellowClosed, kCellKeyYellow),
+]
+
+_kExitCellTypes = [kCellExitClosed, kCellExitOpen, kCellAgentInExit]
+
+# Items which are, or can only turn into, a diamond where they are
+_kGemCellTypes = [kCellDiamond, kCellDiamondFalling, kCellExplosionDiamond, kCellNut, kCellNutFalling]
+
+# Largest area around the agent searched when checking if it is sealed in
+kMaxSealedCells = 8
+
+# Key of each closed gate
+_kGateKeys = {gate: key for gate, key in kGateKeyCellTypes}
+
+# Creatures which explode into a 3x3 area of diamonds
+_kGemExplosionCellTypes = [
+    i for i in range(NUM_HIDDEN_CELL_TYPE) if kExplosionToCell[kCellToExplosion[i]] == kCellDiamond
+]
+_kGemsPerExplosion = 9
+
+# Items which can make any number of diamonds, magic walls from falling stones and blobs once enclosed
+_kGemSourceCellTypes = [kCellWallMagicDormant, kCellWallMagicOn, kCellBlob]
+
+
+class DeadlockAnalysis:
+    """Reachability over the rooms of a map, along with local checks for stones which can never move, used to
+    find states which can never reach a solution.
+
+    The agent can only move between rooms through doors, and a closed gate stays closed until the agent collects
+    a key of its colour. Keys never move and can't be destroyed, so which rooms the agent can reach only depends
+    on its room and which gate colours are still closed, and is cached for each of those.
+
+    A cell is fixed if it is an immutable wall, outside the map, or a stone out of blast reach which can never
+    fall, roll or be pushed because of the fixed cells around it. The agent can never enter a fixed cell, which
+    finds diamonds buried under a stone between walls and the agent sealed in a small area.
+    """
+
+    def __init__(self, structure: MapStructure, grid: np.ndarray):
+        self._structure = structure
+        self._rooms = structure.rooms
+        self._rows, self._cols = structure.rows, structure.cols
+        self._immutable = structure.immutable
+        self._blast_reach = structure.blast_reach
+        gate_colours = {gate: colour for colour, (gate, _) in enumerate(kGateKeyCellTypes)}
+        # Colour of each door which starts closed, -1 for doors which start open
+        self._door_colours = [gate_colours.get(cell_type, -1) for _, cell_type, _ in structure.doors]
+        # Colours of the keys in each room
+        self._room_keys = [[] for _ in range(structure.num_rooms)]
+        for colour, (_, key) in enumerate(kGateKeyCellTypes):
+            for room in set(self._rooms[grid == key].tolist()):
+                if room >= 0:
+                    self._room_keys[room].append(colour)
+        self._exit_rooms = set(self._rooms[np.isin(grid, _kExitCellTypes)].tolist())
+        self._reachable = {}
+
+    def room_of(self, coord: Tuple[int, int]) -> int:
+        """Get the room of a cell, or -1 for immutable walls and doors"""
+        return self._rooms.item(coord[0], coord[1])
+
+    def reachable_rooms(self, room: int, closed: Tuple[bool]) -> Tuple[List[bool], bool]:
+        """Get the rooms the agent can reach from a room and whether an exit is in one of them.
+
+        Args:
+            room: Room the agent is in
+            closed: Flag for each colour in kGateKeyCellTypes if its gates are still closed
+
+        Returns:
+            A flag for each room if it can be reached, and a flag if an exit can be reached
+        """
+        cache_key = (room, closed)
+        reachable = self._reachable.get(cache_key)
+        if reachable is not None:
+            return reachable
+
+        room_graph = self._structure.room_graph
+        opened = [not is_closed for is_closed in closed]
+        # Rooms waiting behind a closed gate, by colour
+        waiting = [[] for _ in closed]
+        reached = [False] * self._structure.num_rooms
+        reached[room] = True
+        stack = [room]
+        while stack:
+            current = stack.pop()
+            next_rooms = []
+            for colour in self._room_keys[current]:
+                if not opened[colour]:
+                    opened[colour] = True
+                    next_rooms.extend(waiting[colour])
+            for other, door in room_graph[current]:
+                colour = self._door_colours[door]
+                if colour < 0 or opened[colour]:
+                    next_rooms.append(other)
+                else:
+                    waiting[colour].append(other)
+            for other in next_rooms:
+                if not reached[other]:
+                    reached[other] = True
+                    stack.append(other)
+
+        exit_reached = any(exit_room >= 0 and reached[exit_room] for exit_room in self._exit_rooms)
+        reachable = self._reachable[cache_key] = (reached, exit_reached)
+        return reachable
+
+    def is_fixed(self, state: RNDGameState, coord: Tuple[int, int], memo: dict = None) -> bool:
+        """Return True if the cell never changes and the agent can never enter it, see DeadlockAnalysis.
+
+        Args:
+            state: State to check
+            coord: Cell to check, which may be outside the map
+            memo: Results of cells already checked for the state, cells being checked are treated as not fixed
+        """
+        row, col = coord
+        if row < 0 or row >= self._rows or col < 0 or col >= self._cols or self._immutable.item(row, col):
+            return True
+        if state.get_cell(coord) != kCellStone or self._blast_reach.item(row, col):
+            return False
+        if memo is None:
+            memo = {}
+        fixed = memo.get(coord)
+        if fixed is not None:
+            return fixed
+        memo[coord] = False
+        # A stone falls into an empty cell below, and rolls or is pushed into an empty cell to its side. It only
+        # rolls to a side when the cell below that is also empty, and is only pushed from the other side.
+        fixed = self.is_fixed(state, (row + 1, col), memo)
+        if fixed:
+            left, right = self.is_fixed(state, (row, col - 1), memo), self.is_fixed(state, (row, col + 1), memo)
+            fixed = (left or (right and self.is_fixed(state, (row + 1, col - 1), memo))) and (
+                right or (left and self.is_fixed(state, (row + 1, col + 1), memo))
+            )
+        memo[coord] = fixed
+        return fixed
+
+    def is_trapped(self, state: RNDGameState, coord: Tuple[int, int], memo: dict = None) -> bool:
+        """Return True if a diamond can never be collected, as it is buried under a stone which can never move with
+        fixed cells on its other sides"""
+        row, col = coord
+        above = (row - 1, col)
+        if row == 0 or state.get_cell(above) != kCellStone or self._blast_reach.item(row, col):
+            return False
+        if self._blast_reach.item(row - 1, col):
+            return False
+        if memo is None:
+            memo = {}
+        return (
+            self.is_fixed(state, (row - 1, col - 1), memo)
+            and self.is_fixed(state, (row - 1, col + 1), memo)
+            and self.is_fixed(state, (row, col - 1), memo)
+            and self.is_fixed(state, (row, col + 1), memo)
+            and self.is_fixed(state, (row + 1, col), memo)
+        )
+
+    def is_sealed(self, state: RNDGameState) -> bool:
+        """Return True if the agent is sealed in an area of at most kMaxSealedCells cells without an exit, by fixed
+        cells and gates which can never open"""
+        agent_pos = state.get_agent_position()
+        memo = {}
+        seen = {agent_pos}
+        stack = [agent_pos]
+        area = 1
+        while stack:
+            row, col = stack.pop()
+            for coord in ((row - 1, col), (row, col + 1), (row + 1, col), (row, col - 1)):
+                if coord in seen:
+                    continue
+                seen.add(coord)
+                if coord[0] < 0 or coord[0] >= self._rows or coord[1] < 0 or coord[1] >= self._cols:
+                    continue
+                if self._immutable.item(coord[0], coord[1]):
+                    continue
+                cell_type = state.get_cell(coord)
+                if cell_type == kCellStone and self.is_fixed(state, coord, memo):
+                    continue
+                if cell_type in _kExitCellTypes:
+                    return False
+                if cell_type in _kGateKeys and state.count(_kGateKeys[cell_type]) == 0:
+                    continue
+                area += 1
+                if area > kMaxSealedCells:
+                    return False
+                stack.append(coord)
+        return True
+
+
+def _has_enough_gems(state: RNDGameState, analysis: DeadlockAnalysis, reached: List[bool]) -> bool:
+    needed = state.get_gems_required() - state.get_gems_collected()
+    # Open exits never close, and maps can start with one open whatever the gems required
+    if needed <= 0 or state.count(kCellExitOpen) > 0:
+        return True
+    for cell_type in _kGemSourceCellTypes:
+        if state.count(cell_type) > 0:
+            return True
+
+    # Upper bound on the diamonds left, exploding creatures are counted anywhere as blasts reach past walls
+    available = _kGemsPerExplosion * sum(state.count(cell_type) for cell_type in _kGemExplosionCellTypes)
+    if available + sum(state.count(cell_type) for cell_type in _kGemCellTypes) < needed:
+        return False
+    if available >= needed:
+        return True
+    # Count the diamonds in reachable rooms, other than diamonds buried under a stone which can never move
+    memo = {}
+    for cell_type in _kGemCellTypes:
+        for coord in state.positions(cell_type):
+            room = analysis.room_of(coord)
+            if room >= 0 and not reached[room]:
+                continue
+            if cell_type == kCellDiamond and analysis.is_trapped(state, coord, memo):
+                continue
+            available += 1
+            if available >= needed:
+                return True
+    return False
+
+
+def is_dead(state: RNDGameState) -> bool:
+    """Return True if the state can never reach a solution.
+
+    A state is dead if the agent is gone, no exit is in a room the agent can still reach, the agent is sealed in
+    by walls and stones which can never move, or fewer diamonds are left in the reachable rooms than are needed to
+    open a closed exit, not counting diamonds buried under a stone which can never move. The checks are
+    conservative, a state which isn't dead may still have no solution.
+    """
+    if state.is_solution():
+        return False
+    if state.is_terminal():
+        return True
+    analysis = get_deadlock_analysis(state)
+    closed = tuple(state.count(gate) > 0 for gate, _ in kGateKeyCellTypes)
+    reached, exit_reached = analysis.reachable_rooms(analysis.room_of(state.get_agent_position()), closed)
+    if not exit_reached or analysis.is_sealed(state):
+        return True
+    return not _has_enough_gems(state, analysis, reached)
+
+
+# Deadlock analysis of each map, keyed by map hash
+_deadlock_analyses = {}
+
+
+def get_deadlock_analysis(state: RNDGameState) -> DeadlockAnalysis:
+    """Get the deadlock analysis of the map the state is playing, computing it on first use."""
+    key = state.map_hash()
+    analysis = _deadlock_analyses.get(key)
+    if analysis is None:
+        analysis = _deadlock_analyses[key] = DeadlockAnalysis(get_map_structure(state), state.starting_grid())
+    return analysis
+
+
+def clear_deadlock_analyses() -> None:
+    """Clear the deadlock analysis cache."""
+    _deadlock_analyses.clear()
@@ -1,9 +1,8 @@
 import sys
 import os
-import hashlib
-from copy import deepcopy
+import heapq
+import struct
 import numpy as np
-from wandb import agent
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from util.rnd_definitions import *
@@ -18,448 +17,680 @@ kDefaultGameParams = {
     "blob_max_percentage": 0.16,  # Max number of blobs before they collapse (percentage of map size)
     "rng_seed": 0,  # Seed for anything that uses the rng
     "gravity": True, # Gravity which effects some objects
+    "hash_ids": None,  # Flag to include element ids in the state hash (defaults to obs_show_ids)
+    "hash_counters": False,  # Flag to include step counters and the rng state in the state hash
 }
 
 
+# Vectorized versions of the cell type tables, used when (re)building derived state for the whole grid
+kHiddenToVisibleChannel = np.array(kCellToVisible, dtype=np.int64)
+kAlwaysActiveCellTypes = np.array(kIsAlwaysActiveCell, dtype=bool)
+kGravityCellTypes = np.array(kIsGravityCell, dtype=bool)
+kSupportsMovementCellTypes = np.array(kSupportsMovementCell, dtype=bool)
+kIndexedCellTypes = np.array(kIsIndexedCell, dtype=bool)
+
+
+# Zobrist keys for each map size, shared by all states with the same size
+_kZobristSeed = 0x5EED
+_kHashMask = (1 << 64) - 1
+_zobrist_tables = {}
+
+
+def _get_zobrist_table(rows: int, cols: int) -> Tuple[np.ndarray, list, np.ndarray, list]:
+    """Get the zobrist keys for a map size, as (area, NUM_HIDDEN_CELL_TYPE) uint64 array, the same keys
+    as a flat list indexed by cell index * NUM_HIDDEN_CELL_TYPE + cell type, and the keys per cell
+    index used to hash element ids as a uint64 array and a list.
+    """
+    if (rows, cols) not in _zobrist_tables:
+        rng = np.random.default_rng([_kZobristSeed, rows, cols])
+        keys = rng.integers(0, 1 << 64, size=(rows * cols, NUM_HIDDEN_CELL_TYPE), dtype=np.uint64, endpoint=False)
+        id_keys = rng.integers(0, 1 << 64, size=rows * cols, dtype=np.uint64, endpoint=False)
+        _zobrist_tables[(rows, cols)] = (keys, keys.ravel().tolist(), id_keys, id_keys.tolist())
+    return _zobrist_tables[(rows, cols)]
+
+
+def _mix64(x: int) -> int:
+    # splitmix64 finalizer
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _kHashMask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _kHashMask
+    return x ^ (x >> 31)
+
+
+# Binary state record written by RNDGameState.to_bytes, a fixed size header followed by the cell type plane
+# (int8) and, if ids are shown, the id plane (uint16). Bump the version when the layout changes.
+kStateRecordMagic = b"RNDS"
+kStateRecordVersion = 1
+_kStateRecordHeader = struct.Struct(
+    "<4sHHHH"  # magic, version, rows, cols, flags
+    "iiiiiibiIiii"  # gems required, max steps, steps remaining, gems collected, magic wall steps, blob chance,
+    # blob swap, blob size, id counter, reward signal, min diamond dist, max diamond door dist
+    "dd"  # current reward, blob max size
+    "QQQQBI"  # rng state (hi, lo), rng inc (hi, lo), has_uint32, uinteger
+)
+# Header flag bits
+_kRecordObsShowIds = 1 << 0
+_kRecordGravity = 1 << 1
+_kRecordHashIds = 1 << 2
+_kRecordHashCounters = 1 << 3
+_kRecordMagicActive = 1 << 4
+_kRecordBlobEnclosed = 1 << 5
+_kRecordNoMaxSteps = 1 << 6
+_kRecordNoStepsRemaining = 1 << 7
+_kRecordNoMinDiamondDist = 1 << 8
+_kRecordNoMaxDiamondDoorDist = 1 << 9
+
+
 def l1_distance(coord1, coord2):
     return abs(coord1[0] - coord2[0]) + abs(coord1[1] - coord2[1])
 
 
+def _get_active_cells(grid: np.ndarray) -> set:
+    # Treat below the bottom row as steel wall, nothing can fall out of the map
+    below = np.full(grid.shape, kCellWallSteel, dtype=grid.dtype)
+    below[:-1, :] = grid[1:, :]
+    is_active = kAlwaysActiveCellTypes[grid] | (kGravityCellTypes[grid] & kSupportsMovementCellTypes[below])
+    return set(np.flatnonzero(is_active).tolist())
+
+
+def _get_cell_zobrist(grid: np.ndarray) -> int:
+    keys = _get_zobrist_table(*grid.shape)[0]
+    return int(np.bitwise_xor.reduce(keys[np.arange(grid.size), grid.ravel()]))
+
+
+def _get_id_zobrist(ids: np.ndarray) -> int:
+    # Vectorized _mix64 of each id key with its id, uint64 arithmetic wraps the same as masking
+    x = _get_zobrist_table(*ids.shape)[2] ^ ids.ravel().astype(np.uint64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return int(np.bitwise_xor.reduce(x ^ (x >> np.uint64(31))))
+
+
+def _get_agent_pos(grid: np.ndarray) -> Tuple[int, int]:
+    agent_pos = np.argwhere(grid == kCellAgent)
+    return tuple(agent_pos[0].tolist()) if len(agent_pos) > 0 else None
+
+
+def _get_positions(grid: np.ndarray) -> dict:
+    # Flat indices of the items of each indexed cell type
+    flat_grid = grid.ravel()
+    idxs = np.flatnonzero(kIndexedCellTypes[flat_grid])
+    positions = {}
+    for idx, cell_type in zip(idxs.tolist(), flat_grid[idxs].tolist()):
+        positions.setdefault(cell_type, set()).add(idx)
+    return positions
+
+
+class RNDMapTemplate:
+    """Starting map, along with the state derived from the starting grid.
+    Templates are read-only and shared by every state created from the same map.
+    """
+
+    def __init__(self, map_ids: np.ndarray, max_steps: int, gems_required: int):
+        """Create a template from an array of HiddenCellTypes
+
+        Args:
+            map_ids: (rows, cols) array of HiddenCellTypes
+            max_steps: Maximum number of steps, no limit if None or not positive
+            gems_required: Number of gems required to open the exit
+        """
+        map_ids = np.asarray(map_ids)
+        assert map_ids.ndim == 2
+        self.rows, self.cols = map_ids.shape
+        self.gems_required = gems_required
+        self.max_steps = max_steps if max_steps is not None and max_steps > 0 else None
+
+        # Plane of cell types, and the plane of element ids when ids are shown (ids are all 1 otherwise)
+        self.grid = np.array(map_ids, dtype=np.int8)
+        has_id = (self.grid != kCellEmpty) & (self.grid != kCellDirt)
+        self.ids = np.ones((self.rows, self.cols), dtype=np.uint16)
+        self.ids[has_id] = np.arange(2, 2 + np.count_nonzero(has_id)).astype(np.uint16)
+        self.id_counter = 1 + int(np.count_nonzero(has_id))
+        self.grid.flags.writeable = False
+        self.ids.flags.writeable = False
+
+        # Derived state
+        self.active = frozenset(_get_active_cells(self.grid))
+        self.type_counts = tuple(np.bincount(self.grid.ravel(), minlength=NUM_HIDDEN_CELL_TYPE).tolist())
+        self.agent_pos = _get_agent_pos(self.grid)
+        self.positions = {cell_type: frozenset(idxs) for cell_type, idxs in _get_positions(self.grid).items()}
+        self.zobrist = _get_cell_zobrist(self.grid)
+        self.zobrist_ids = _get_id_zobrist(self.ids)
+        self.zobrist_unit_ids = _get_id_zobrist(np.ones_like(self.ids))
+
+        # Any heuristic calculcations
+        diamon_pos = np.argwhere((self.grid == kCellDiamond) | (self.grid == kCellDiamondFalling)).tolist()
+        exit_closed = np.argwhere(self.grid == kCellExitClosed).tolist()
+        self.min_diamond_dist = None
+        if len(diamon_pos) > 0 and self.agent_pos is not None:
+            self.min_diamond_dist = min([l1_distance(self.agent_pos, d) for d in diamon_pos])
+
+        self.max_diamond_door_dist = None
+        if len(exit_closed) > 0 and self.agent_pos is not None:
+            self.max_diamond_door_dist = max([l1_distance(exit_closed[0], d) for d in diamon_pos])
+
+    @classmethod
+    def from_str(cls, map_str: str) -> "RNDMapTemplate":
+        """Create a template from a map string"""
+        splt_symbol = "," if map_str.count(",") > 0 else "|"
+        lines = [list(map(int, s.split(splt_symbol))) for s in map_str.split("\n")]
+        assert len(lines[0]) == 4
+        cols, rows, max_steps, gems_required = lines[0]
+        lines = lines[1:]
+        assert len(lines) == rows
+        for line in lines:
+            assert len(line) == cols
+        return cls(np.array(lines, dtype=np.int64).reshape(rows, cols), max_steps, gems_required)
+
+
+# Parsed map templates, keyed by map string or by starting grid for templates of unpickled states
+_map_templates = {}
+
+
+def get_map_template(map_str: str) -> RNDMapTemplate:
+    """Get the parsed template of a map string, parsing it on first use."""
+    template = _map_templates.get(map_str)
+    if template is None:
+        template = _map_templates[map_str] = RNDMapTemplate.from_str(map_str)
+    return template
+
+
+def get_grid_template(grid_bytes: bytes, rows: int, cols: int, max_steps: int, gems_required: int) -> RNDMapTemplate:
+    """Get the template of a starting grid given as the bytes of its (rows, cols) int8 cell types, creating it on
+    first use. Templates are kept in the same cache as the parsed map strings."""
+    key = (grid_bytes, rows, cols, max_steps, gems_required)
+    template = _map_templates.get(key)
+    if template is None:
+        map_ids = np.frombuffer(grid_bytes, dtype=np.int8).reshape(rows, cols)
+        template = _map_templates[key] = RNDMapTemplate(map_ids, max_steps, gems_required)
+    return template
+
+
+def clear_map_templates() -> None:
+    """Clear the parsed map templates cache."""
+    _map_templates.clear()
+
+
 class RNDGameState:
     def __init__(self, game_params: dict):
         if "grid" not in game_params:
             print("Error: constructor requires grid param.")
             raise ValueError
         # overwrite param defaults with user provided params
-        params = deepcopy(kDefaultGameParams)
-        for k, v in game_params.items():
-            params[k] = v
+        params = dict(kDefaultGameParams)
+        params.update(game_params)
 
         # self._params = params
 
         # Set members
         self.reset(params)
 
-    def _parse_grid(self, params) -> None:
-        splt_symbol = "," if params["grid"].count(",") > 0 else "|"
-        lines = [list(map(int, s.split(splt_symbol))) for s in params["grid"].split("\n")]
-        assert len(lines[0]) == 4
-        self._cols, self._rows, self._gems_required = lines[0][0], lines[0][1], lines[0][3]
-        self._max_steps = lines[0][2] if lines[0][2] > 0 else None
-        self._blob_max_size = params["blob_max_percentage"] * self._cols * self._rows
-
-        # Create grid
-        lines = lines[1:]
-        if self._obs_show_ids:
-            self._grid = np.zeros((NUM_HIDDEN_CELL_TYPE, self._rows, self._cols), dtype=np.uint16)
-        else:
-            self._grid = np.zeros((NUM_HIDDEN_CELL_TYPE, self._rows, self._cols), dtype=bool)
-        self._has_updated = np.zeros((self._rows, self._cols), dtype=bool)
-        assert len(lines) == self._rows
-        for r, line in enumerate(lines):
-            for c in range(self._cols):
-                assert len(line) == self._cols
-                self._has_updated[r, c] = False
-                if line[c] == HiddenCellType.kEmpty or line[c] == HiddenCellType.kDirt:
-                    self._grid[line[c], r, c] = 1
-                else:
-                    self._increment_counter()
-                    self._grid[line[c], r, c] = self._id_counter
-
-        self._unpacked_size = self._grid.size
-        self._unpacked_shape = self._grid.shape
-        self._pack_grid()
-
-    def _pack_grid(self):
-        if not self._obs_show_ids:
-            self._grid = np.packbits(self._grid, axis=None)
-
-    def _unpack_grid(self):
-        if not self._obs_show_ids:
-            self._grid = np.unpackbits(self._grid, count=self._unpacked_size).reshape(self._unpacked_shape).view(bool)
-
     def _increment_counter(self):
         if self._obs_show_ids:
             self._id_counter += 1
         else:
             self._id_counter = 1
 
-    def _check_channel(self, coord: Tuple[int, int]) -> bool:
-        channel_index = np.where(self._grid[(slice(None), *coord)] > 0)[0]
-        return channel_index.size == 1
-
-    def _grid_to_channel(self, coord: Tuple[int, int]) -> int:
-        channel_index = np.where(self._grid[(slice(None), *coord)] > 0)[0]
-        assert channel_index.size == 1
-        return channel_index.item()
-
     def _grid_to_element(self, coord: Tuple[int, int]) -> Element:
-        return kHiddenCellTypeToElement[HiddenCellType(self._grid_to_channel(coord))]
+        return kHiddenCellTypeToElement[self._grid.item(coord)]
 
     def _grid_to_id(self, coord: Tuple[int, int]) -> int:
-        channel = self._grid_to_channel(coord)
-        return self._grid[(channel, *coord)]
+        return self._ids.item(coord)
 
-    def _in_bounds(self, coord: Tuple[int, int], action: Directions = Directions.kNone) -> bool:
-        row, col = coord_from_action(coord, action)
+    def _in_bounds(self, coord: Tuple[int, int], action: int = kDirNone) -> bool:
+        row, col = coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action]
         return col >= 0 and col < self._cols and row >= 0 and row < self._rows
 
-    def _is_type(self, coord: Tuple[int, int], element: Element, action: Directions = Directions.kNone) -> bool:
-        new_coord = coord_from_action(coord, action)
-        return self._in_bounds(coord, action) and self._grid_to_element(new_coord) == element
+    def _is_type(self, coord: Tuple[int, int], cell_type: int, action: int = kDirNone) -> bool:
+        row, col = coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action]
+        return col >= 0 and col < self._cols and row >= 0 and row < self._rows and self._grid.item(row, col) == cell_type
 
-    def _has_property(self, coord: Tuple[int, int], property: ElementProperties, action: Directions = Directions.kNone) -> bool:
-        new_coord = coord_from_action(coord, action)
-        return self._in_bounds(coord, action) and (self._grid_to_element(new_coord).properties & property) > 0
+    def _has_property(self, coord: Tuple[int, int], property: int, action: int = kDirNone) -> bool:
+        row, col = coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action]
+        return (
+            col >= 0
+            and col < self._cols
+            and row >= 0
+            and row < self._rows
+            and (kCellProperties[self._grid.item(row, col)] & property) > 0
+        )
 
-    def _move_item(self, coord: Tuple[int, int], action: Directions) -> None:
+    def _move_item(self, coord: Tuple[int, int], action: int) -> None:
         new_coord = coord_from_action(coord, action)
-        channel_old = self._grid_to_channel(coord)
-        channel_new = self._grid_to_channel(new_coord)
-        self._grid[(channel_old, *new_coord)] = self._grid[(channel_old, *coord)]  # Move item
-        self._grid[(channel_old, *coord)] = 0  # Unset previous item in old coord
-        self._grid[(channel_new, *new_coord)] = 0  # Unset previous item in new coord
-        self._grid[(HiddenCellType.kEmpty, *coord)] = 1  # Set previous coord to empty
+        # Move item, overwriting what was in new coord, and set previous coord to empty
+        self._write_cell(new_coord, self._grid.item(coord), self._ids.item(coord))
+        self._write_cell(coord, kCellEmpty, 1)
         self._has_updated[new_coord] = True
-        assert self._check_channel(coord) == True
-        assert self._check_channel(new_coord) == True
 
-    def _set_item(self, coord: Tuple[int, int], element: Element, id: int, action: Directions = Directions.kNone) -> None:
+    def _set_item(self, coord: Tuple[int, int], cell_type: int, id: int, action: int = kDirNone) -> None:
         new_coord = coord_from_action(coord, action)
-        old_channel = self._grid_to_channel(new_coord)
-        self._grid[(old_channel, *new_coord)] = 0  # Need to ensure we remove item already existing here
-        new_channel = int(element.cell_type)
-        self._grid[(new_channel, *new_coord)] = id
-        assert self._check_channel(new_coord) == True  # Ensure exactly 1 channel is set
-
-    def _get_item(self, coord: Tuple[int, int], action: Directions = Directions.kNone) -> Element:
-        new_coord = coord_from_action(coord, action)
-        return self._grid_to_element(new_coord)
-
-    def _get_id(self, coord: Tuple[int, int], action: Directions = Directions.kNone) -> int:
-        new_coord = coord_from_action(coord, action)
-        return self._grid_to_id(new_coord)
-
-    def _is_type_adjacent(self, coord: Tuple[int, int], element: Element) -> bool:
+        self._write_cell(new_coord, cell_type, id)  # Overwrites item already existing here
+
+    def _write_cell(self, coord: Tuple[int, int], cell_type: int, id: int) -> None:
+        # All cell writes go through here so the derived state stays in sync with the grid
+        old_type = self._grid.item(coord)
+        if self._undo_cells is not None:
+            self._undo_cells.append((coord, old_type, self._ids.item(coord)))
+        idx = coord[0] * self._cols + coord[1]
+        if self._obs_cache is not None:
+            self._obs_dirty.add(idx)
+        key_idx = idx * NUM_HIDDEN_CELL_TYPE
+        self._zobrist ^= self._zobrist_keys[key_idx + old_type] ^ self._zobrist_keys[key_idx + cell_type]
+        if self._hash_ids:
+            id_key = self._zobrist_id_keys[idx]
+            self._zobrist ^= _mix64(id_key ^ self._ids.item(coord)) ^ _mix64(id_key ^ id)
+        self._type_counts[old_type] -= 1
+        self._type_counts[cell_type] += 1
+        if kIsIndexedCell[old_type]:
+            self._positions[old_type].discard(idx)
+        if kIsIndexedCell[cell_type]:
+            positions = self._positions.get(cell_type)
+            if positions is None:
+                self._positions[cell_type] = {idx}
+            else:
+                positions.add(idx)
+        if cell_type == kCellAgent:
+            self._agent_pos = coord
+        elif old_type == kCellAgent and self._agent_pos == coord:
+            self._agent_pos = None
+        self._grid[coord] = cell_type
+        self._ids[coord] = id
+        self._cell_changed(coord)
+
+    def _cell_changed(self, coord: Tuple[int, int]) -> None:
+        # Whether an item can update depends on its own type and the cell below it
+        self._update_active(coord)
+        if coord[0] > 0:
+            self._update_active((coord[0] - 1, coord[1]))
+
+    def _update_active(self, coord: Tuple[int, int]) -> None:
+        r, c = coord
+        cell_type = self._grid.item(r, c)
+        if kIsAlwaysActiveCell[cell_type]:
+            is_active = True
+        elif kIsGravityCell[cell_type]:
+            is_active = r + 1 < self._rows and kSupportsMovementCell[self._grid.item(r + 1, c)]
+        else:
+            is_active = False
+
+        idx = r * self._cols + c
+        if not is_active:
+            self._active.discard(idx)
+        elif idx not in self._active:
+            self._active.add(idx)
+            # Cells which become active ahead of the current scan position are updated during this scan
+            if self._scan_queue is not None and idx > self._scan_idx:
+                heapq.heappush(self._scan_queue, idx)
+
+    def _init_active(self) -> None:
+        self._active = _get_active_cells(self._grid)
+        self._scan_queue = None
+        self._scan_idx = -1
+
+    def _init_tracking(self) -> None:
+        self._type_counts = np.bincount(self._grid.ravel(), minlength=NUM_HIDDEN_CELL_TYPE).tolist()
+        self._agent_pos = _get_agent_pos(self._grid)
+        self._positions = _get_positions(self._grid)
+
+    def _init_zobrist(self) -> None:
+        _, self._zobrist_keys, _, self._zobrist_id_keys = _get_zobrist_table(self._rows, self._cols)
+        self._zobrist = _get_cell_zobrist(self._grid)
+        if self._hash_ids:
+            self._zobrist ^= _get_id_zobrist(self._ids)
+
+    def _get_rng(self) -> np.random.Generator:
+        # Clones only hold the rng state until they need to draw from it
+        if self._rng is None:
+            bit_generator = np.random.PCG64(0)
+            bit_generator.state = self._rng_state
+            self._rng = np.random.Generator(bit_generator)
+            self._rng_state = None
+        return self._rng
+
+    def _get_rng_state(self) -> dict:
+        return self._rng_state if self._rng is None else self._rng.bit_generator.state
+
+    def _get_item(self, coord: Tuple[int, int], action: int = kDirNone) -> int:
+        return self._grid.item(coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action])
+
+    def _get_id(self, coord: Tuple[int, int], action: int = kDirNone) -> int:
+        return self._ids.item(coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action])
+
+    def _is_type_adjacent(self, coord: Tuple[int, int], cell_type: int) -> bool:
         return (
-            self._is_type(coord, element, Directions.kUp)
-            or self._is_type(coord, element, Directions.kLeft)
-            or self._is_type(coord, element, Directions.kDown)
-            or self._is_type(coord, element, Directions.kRight)
+            self._is_type(coord, cell_type, kDirUp)
+            or self._is_type(coord, cell_type, kDirLeft)
+            or self._is_type(coord, cell_type, kDirDown)
+            or self._is_type(coord, cell_type, kDirRight)
         )
 
     def _can_roll_left(self, coord: Tuple[int, int]) -> bool:
         return (
-            self._has_property(coord, ElementProperties.kRounded, Directions.kDown)
-            and self._is_type(coord, kElEmpty, Directions.kLeft)
-            and self._is_type(coord, kElEmpty, Directions.kDownLeft)
+            self._has_property(coord, kPropRounded, kDirDown)
+            and self._is_type(coord, kCellEmpty, kDirLeft)
+            and self._is_type(coord, kCellEmpty, kDirDownLeft)
         )
 
     def _can_roll_right(self, coord: Tuple[int, int]) -> bool:
         return (
-            self._has_property(coord, ElementProperties.kRounded, Directions.kDown)
-            and self._is_type(coord, kElEmpty, Directions.kRight)
-            and self._is_type(coord, kElEmpty, Directions.kDownRight)
+            self._has_property(coord, kPropRounded, kDirDown)
+            and self._is_type(coord, kCellEmpty, kDirRight)
+            and self._is_type(coord, kCellEmpty, kDirDownRight)
         )
 
-    def _roll_left(self, coord: Tuple[int, int], element: Element) -> None:
-        self._set_item(coord, element, self._get_id(coord))
-        self._move_item(coord, Directions.kLeft)
+    def _roll_left(self, coord: Tuple[int, int], cell_type: int) -> None:
+        self._set_item(coord, cell_type, self._get_id(coord))
+        self._move_item(coord, kDirLeft)
 
-    def _roll_right(self, coord: Tuple[int, int], element: Element) -> None:
-        self._set_item(coord, element, self._get_id(coord))
-        self._move_item(coord, Directions.kRight)
+    def _roll_right(self, coord: Tuple[int, int], cell_type: int) -> None:
+        self._set_item(coord, cell_type, self._get_id(coord))
+        self._move_item(coord, kDirRight)
 
-    def _push(self, coord: Tuple[int, int], stationary: Element, falling: Element, action: Directions) -> None:
+    def _push(self, coord: Tuple[int, int], stationary: int, falling: int, action: int) -> None:
         new_coord = coord_from_action(coord, action)
-        if self._is_type(new_coord, kElEmpty, action):
+        if self._is_type(new_coord, kCellEmpty, action):
             # Check if the element will become stationary or falling
             next_coord = coord_from_action(new_coord, action)
-            is_empty = self._is_type(next_coord, kElEmpty, Directions.kDown)
-            self._set_item(new_coord, falling if is_empty else stationary, self._grid_to_id(new_coord), action)
+            is_empty = self._is_type(next_coord, kCellEmpty, kDirDown)
+            self._set_item(new_coord, falling if is_empty else stationary, self._get_id(new_coord), action)
             self._move_item(coord, action)  # Move agent
 
-    def _move_through_magic(self, coord: Tuple[int, int], element: Element) -> None:
+    def _move_through_magic(self, coord: Tuple[int, int], cell_type: int) -> None:
         # Check if magic wall is still active
         if self._magic_wall_steps <= 0:
             return
 
         self._magic_active = True
-        coord_below = coord_from_action(coord, Directions.kDown)
+        coord_below = coord_from_action(coord, kDirDown)
         # Need to ensure cell below magic wall is empty (so item can pass through)
-        if self._is_type(coord_below, kElEmpty, Directions.kDown):
-            self._set_item(coord, kElEmpty, 1)  # Empty and dirt ids are 1
+        if self._is_type(coord_below, kCellEmpty, kDirDown):
+            self._set_item(coord, kCellEmpty, 1)  # Empty and dirt ids are 1
             self._increment_counter()
-            self._set_item(coord_below, element, self._id_counter, Directions.kDown)  # Spawned element gets new id
+            self._set_item(coord_below, cell_type, self._id_counter, kDirDown)  # Spawned element gets new id
 
-    def _explode(self, coord: Tuple[int, int], element: Element, action: Directions = Directions.kNone) -> None:
-        new_coord = coord_from_action(coord, action)
-        old_element = self._get_item(new_coord)
-        exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
+    def _ignite(self, coord: Tuple[int, int], cell_type: int) -> Tuple[int, int, int, int]:
+        # Set the center of a blast, and return its explosion frame of (row, col, exploded type, next direction)
+        exploded_type = kCellToExplosion[self._grid.item(coord)]
         self._increment_counter()
-        self._set_item(new_coord, element, self._id_counter)
-
-        # Recursively check all directions for chain explosions
-        for direction in Directions:
-            if direction == Directions.kNone or not self._in_bounds(new_coord, direction):
-                continue
-            if self._has_property(new_coord, ElementProperties.kCanExplode, direction):
-                self._explode(new_coord, exploded_element, direction)
-            elif self._has_property(new_coord, ElementProperties.kConsumable, direction):
-                self._increment_counter()
-                self._set_item(new_coord, exploded_element, self._id_counter, direction)
+        self._set_item(coord, cell_type, self._id_counter)
+        return (coord[0], coord[1], exploded_type, kDirUp)
+
+    def _explode(self, coord: Tuple[int, int], cell_type: int, action: int = kDirNone) -> None:
+        # Chain explosions are resolved depth first with an explicit stack of explosion frames. A blast pauses
+        # when a neighbour ignites and resumes once that chain is resolved, giving the same cell and id order
+        # as recursing into each neighbour.
+        grid, rows, cols = self._grid, self._rows, self._cols
+        stack = [self._ignite(coord_from_action(coord, action), cell_type)]
+        while stack:
+            row, col, exploded_type, direction = stack.pop()
+            while direction < NUM_DIRECTIONS:
+                new_row, new_col = row + kDirectionRowOffsets[direction], col + kDirectionColOffsets[direction]
+                direction += 1
+                if new_col < 0 or new_col >= cols or new_row < 0 or new_row >= rows:
+                    continue
+                properties = kCellProperties[grid.item(new_row, new_col)]
+                if properties & kPropCanExplode:
+                    stack.append((row, col, exploded_type, direction))
+                    stack.append(self._ignite((new_row, new_col), exploded_type))
+                    break
+                elif properties & kPropConsumable:
+                    self._increment_counter()
+                    self._set_item((new_row, new_col), exploded_type, self._id_counter)
 
-    def _open_gate(self, el_gate_closed: Element) -> None:
-        el_gate_open = kGateOpenMap[el_gate_closed]
-        closed_gate_indices = np.transpose((self._grid[int(el_gate_closed.cell_type), :, :]).nonzero())
+    def _open_gate(self, gate_closed: int) -> None:
+        gate_open = kGateOpenCell[gate_closed]
         # Convert closed gates to open
-        for idx in closed_gate_indices:
-            coord = (idx[0].item(), idx[1].item())
-            self._set_item(coord, el_gate_open, self._grid_to_id(coord))
+        for idx in sorted(self._positions.get(gate_closed, ())):
+            coord = divmod(idx, self._cols)
+            self._set_item(coord, gate_open, self._get_id(coord))
 
     def _update_stone(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):
+        if self._is_type(coord, kCellEmpty, kDirDown):
             # Set to falling if gravity is on
             if not self._gravity:
                 return
-            self._set_item(coord, kElStoneFalling, self._grid_to_id(coord))
+            self._set_item(coord, kCellStoneFalling, self._get_id(coord))
             self._update_stone_falling(coord)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElStoneFalling)
+            self._roll_left(coord, kCellStoneFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElStoneFalling)
+            self._roll_right(coord, kCellStoneFalling)
 
     def _update_stone_falling(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):  # Continue to fall
-            self._move_item(coord, Directions.kDown)
-        elif self._has_property(coord, ElementProperties.kCanExplode, Directions.kDown):  # Falling stones explode items
-            old_element = self._get_item(coord, Directions.kDown)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element, Directions.kDown)
-        elif self._is_type(coord, kElWallMagicOn, Directions.kDown) or self._is_type(
-            coord, kElWallMagicDormant, Directions.kDown
+        if self._is_type(coord, kCellEmpty, kDirDown):  # Continue to fall
+            self._move_item(coord, kDirDown)
+        elif self._has_property(coord, kPropCanExplode, kDirDown):  # Falling stones explode items
+            self._explode(coord, kCellToExplosion[self._get_item(coord, kDirDown)], kDirDown)
+        elif self._is_type(coord, kCellWallMagicOn, kDirDown) or self._is_type(
+            coord, kCellWallMagicDormant, kDirDown
         ):  # Convert item through magic wall
-            self._move_through_magic(coord, kMagicWallConversion[self._get_item(coord)])
-        elif self._is_type(coord, kElNut, Directions.kDown):  # Falling on nut -> diamond
+            self._move_through_magic(coord, kMagicWallConversionCell[self._get_item(coord)])
+        elif self._is_type(coord, kCellNut, kDirDown):  # Falling on nut -> diamond
             self._increment_counter()
-            self._set_item(coord, kElDiamond, self._id_counter, Directions.kDown)
+            self._set_item(coord, kCellDiamond, self._id_counter, kDirDown)
             self._reward_signal |= RewardCodes.kRewardNutToDiamond
-        elif self._is_type(coord, kElBomb, Directions.kDown):  # Falling on bomb -> explode
-            old_element = self._get_item(coord, Directions.kDown)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element, Directions.kDown)
+        elif self._is_type(coord, kCellBomb, kDirDown):  # Falling on bomb -> explode
+            self._explode(coord, kCellToExplosion[self._get_item(coord, kDirDown)], kDirDown)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElStoneFalling)
+            self._roll_left(coord, kCellStoneFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElStoneFalling)
+            self._roll_right(coord, kCellStoneFalling)
         else:  # Default option is for falling stone to become stationary
-            self._set_item(coord, kElStone, self._grid_to_id(coord))
+            self._set_item(coord, kCellStone, self._get_id(coord))
 
     def _update_diamond(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):
+        if self._is_type(coord, kCellEmpty, kDirDown):
             # Set to falling if gravity is on
             if not self._gravity:
                 return
-            self._set_item(coord, kElDiamondFalling, self._grid_to_id(coord))
+            self._set_item(coord, kCellDiamondFalling, self._get_id(coord))
             self._update_diamond_falling(coord)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElDiamondFalling)
+            self._roll_left(coord, kCellDiamondFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElDiamondFalling)
+            self._roll_right(coord, kCellDiamondFalling)
 
     def _update_diamond_falling(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):  # Continue to fall
-            self._move_item(coord, Directions.kDown)
+        if self._is_type(coord, kCellEmpty, kDirDown):  # Continue to fall
+            self._move_item(coord, kDirDown)
         elif (
-            self._has_property(coord, ElementProperties.kCanExplode, Directions.kDown)
-            and not self._is_type(coord, kElBomb, Directions.kDown)
-            and not self._is_type(coord, kElBombFalling, Directions.kDown)
+            self._has_property(coord, kPropCanExplode, kDirDown)
+            and not self._is_type(coord, kCellBomb, kDirDown)
+            and not self._is_type(coord, kCellBombFalling, kDirDown)
         ):  # Falling diamond explode items (but not bombs)
-            old_element = self._get_item(coord, Directions.kDown)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element, Directions.kDown)
-        elif self._is_type(coord, kElWallMagicOn, Directions.kDown) or self._is_type(
-            coord, kElWallMagicDormant, Directions.kDown
+            self._explode(coord, kCellToExplosion[self._get_item(coord, kDirDown)], kDirDown)
+        elif self._is_type(coord, kCellWallMagicOn, kDirDown) or self._is_type(
+            coord, kCellWallMagicDormant, kDirDown
         ):  # Convert item through magic wall
-            self._move_through_magic(coord, kMagicWallConversion[self._get_item(coord)])
+            self._move_through_magic(coord, kMagicWallConversionCell[self._get_item(coord)])
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElDiamondFalling)
+            self._roll_left(coord, kCellDiamondFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElDiamondFalling)
+            self._roll_right(coord, kCellDiamondFalling)
         else:  # Default option is for falling diamond to become stationary
-            self._set_item(coord, kElDiamond, self._grid_to_id(coord))
+            self._set_item(coord, kCellDiamond, self._get_id(coord))
 
     def _update_nut(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):
+        if self._is_type(coord, kCellEmpty, kDirDown):
             # Set to falling if gravity is on
             if not self._gravity:
                 return
-            self._set_item(coord, kElNutFalling, self._grid_to_id(coord))
+            self._set_item(coord, kCellNutFalling, self._get_id(coord))
             self._update_nut_falling(coord)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElNutFalling)
+            self._roll_left(coord, kCellNutFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElNutFalling)
+            self._roll_right(coord, kCellNutFalling)
 
     def _update_nut_falling(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):  # Continue to fall
-            self._move_item(coord, Directions.kDown)
+        if self._is_type(coord, kCellEmpty, kDirDown):  # Continue to fall
+            self._move_item(coord, kDirDown)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElNutFalling)
+            self._roll_left(coord, kCellNutFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElNutFalling)
+            self._roll_right(coord, kCellNutFalling)
         else:  # Default option is for falling nut to become stationary
-            self._set_item(coord, kElNut, self._grid_to_id(coord))
+            self._set_item(coord, kCellNut, self._get_id(coord))
 
     def _update_bomb(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):  
+        if self._is_type(coord, kCellEmpty, kDirDown):
             # Set to falling if gravity is on
             if not self._gravity:
                 return
-            self._set_item(coord, kElBombFalling, self._grid_to_id(coord))
+            self._set_item(coord, kCellBombFalling, self._get_id(coord))
             self._update_bomb_falling(coord)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElBombFalling)
+            self._roll_left(coord, kCellBombFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElBombFalling)
+            self._roll_right(coord, kCellBombFalling)
 
     def _update_bomb_falling(self, coord: Tuple[int, int]) -> None:
-        if self._is_type(coord, kElEmpty, Directions.kDown):  # Continue to fall
-            self._move_item(coord, Directions.kDown)
+        if self._is_type(coord, kCellEmpty, kDirDown):  # Continue to fall
+            self._move_item(coord, kDirDown)
         elif self._can_roll_left(coord):  # Roll left
-            self._roll_left(coord, kElBombFalling)
+            self._roll_left(coord, kCellBombFalling)
         elif self._can_roll_right(coord):  # Roll right
-            self._roll_right(coord, kElBombFalling)
+            self._roll_right(coord, kCellBombFalling)
         else:  # Default option is for falling bomb is to explode
-            old_element = self._get_item(coord)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element)
+            self._explode(coord, kCellToExplosion[self._get_item(coord)])
 
     def _update_exit(self, coord: Tuple[int, int]) -> None:
         # Open exit if enough gems collected
         if self._gems_collected >= self._gems_required:
-            self._set_item(coord, kElExitOpen, self._grid_to_id(coord))
+            self._set_item(coord, kCellExitOpen, self._get_id(coord))
 
-    def _update_agent(self, coord: Tuple[int, int], action: Directions) -> None:
-        if self._is_type(coord, kElEmpty, action) or self._is_type(coord, kElDirt, action):  # Move if empty/dirt
+    def _update_agent(self, coord: Tuple[int, int], action: int) -> None:
+        # Outside of the map is treated as steel wall
+        item = self._get_item(coord, action) if self._in_bounds(coord, action) else kCellWallSteel
+        if item == kCellEmpty or item == kCellDirt:  # Move if empty/dirt
             self._move_item(coord, action)
-        elif self._is_type(coord, kElDiamond, action) or self._is_type(coord, kElDiamondFalling, action):  # Collect gems
+        elif item == kCellDiamond or item == kCellDiamondFalling:  # Collect gems
             self._gems_collected += 1
-            self._current_reward += kGemPoints[self._get_item(coord, action)]
+            self._current_reward += kGemPointsCell[item]
             self._reward_signal |= RewardCodes.kRewardCollectDiamond
             self._move_item(coord, action)
         elif IsActionHorz(action) and (
-            self._is_type(coord, kElStone, action)
-            or self._is_type(coord, kElNut, action)
-            or self._is_type(coord, kElBomb, action)
+            item == kCellStone or item == kCellNut or item == kCellBomb
         ):  # Push stone, nut, or bomb horizontal
-            self._push(coord, self._get_item(coord, action), kElToFalling[self._get_item(coord, action)], action)
-        elif IsKey(self._get_item(coord, action)):  # Collecting key, set gate open
-            self._open_gate(kKeyToGate[self._get_item(coord, action)])
+            self._push(coord, item, kCellToFalling[item], action)
+        elif kIsKeyCell[item]:  # Collecting key, set gate open
+            self._open_gate(kKeyToGateCell[item])
             self._move_item(coord, action)
             self._reward_signal |= RewardCodes.kRewardCollectKey
-        elif IsOpenGate(self._get_item(coord, action)):  # Walking through open gate
+        elif kIsOpenGateCell[item]:  # Walking through open gate
             coord_gate = coord_from_action(coord, action)
-            if self._has_property(coord_gate, ElementProperties.kTraversable, action):
-                if self._is_type(coord_gate, kElDiamond, action):  # Could pass through onto diamond
+            if self._has_property(coord_gate, kPropTraversable, action):
+                if self._is_type(coord_gate, kCellDiamond, action):  # Could pass through onto diamond
                     self._gems_collected += 1
-                    self._current_reward += kGemPoints[kElDiamond]
+                    self._current_reward += kGemPointsCell[kCellDiamond]
                     self._reward_signal |= RewardCodes.kRewardCollectDiamond
-                elif IsKey(self._get_item(coord_gate, action)):  # Could pass through onto key
-                    self._open_gate(kKeyToGate[self._get_item(coord_gate, action)])
+                elif kIsKeyCell[self._get_item(coord_gate, action)]:  # Could pass through onto key
+                    self._open_gate(kKeyToGateCell[self._get_item(coord_gate, action)])
                     self._reward_signal |= RewardCodes.kRewardCollectKey
-                self._set_item(coord_gate, kElAgent, self._grid_to_id(coord), action)
-                self._set_item(coord, kElEmpty, 1)
+                self._set_item(coord_gate, kCellAgent, self._get_id(coord), action)
+                self._set_item(coord, kCellEmpty, 1)
                 self._reward_signal |= RewardCodes.kRewardWalkThroughGate
-        elif self._is_type(coord, kElExitOpen, action):  # Walking though exit
+        elif item == kCellExitOpen:  # Walking though exit
             self._move_item(coord, action)
-            self._set_item(coord, kElAgentInExit, self._grid_to_id(coord), action)  # Different from open_spiel
-            self._current_reward += self._steps_remaining if self._steps_remaining is not None else kGemPoints[kElAgentInExit]
+            self._set_item(coord, kCellAgentInExit, self._get_id(coord), action)  # Different from open_spiel
+            self._current_reward += (
+                self._steps_remaining if self._steps_remaining is not None else kGemPointsCell[kCellAgentInExit]
+            )
             self._reward_signal |= RewardCodes.kRewardWalkThroughExit
 
-    def _update_firefly(self, coord: Tuple[int, int], action: Directions) -> None:
-        new_direction = kRotateLeft[action]
-        if self._is_type_adjacent(coord, kElAgent) or self._is_type_adjacent(coord, kElBlob):  # Exploide if touching agent/blob
-            old_element = self._get_item(coord)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element)
-        elif self._is_type(coord, kElEmpty, new_direction):  # First try to rotate left
-            self._set_item(coord, kDirectionToFirefly[new_direction], self._grid_to_id(coord))
+    def is_agent_noop(self, action: int) -> bool:
+        """Return True if the agent taking the action would leave the grid unchanged, so stepping with it has the
+        same outcome as the noop action. This checks the same cases as _update_agent without applying them.
+        """
+        coord = self._agent_pos
+        if coord is None or action == kDirNone or not self._in_bounds(coord, action):
+            return True
+        item = self._get_item(coord, action)
+        if kIsAgentEnterableCell[item]:
+            return False
+        if item == kCellStone or item == kCellNut or item == kCellBomb:
+            # Pushed items only move horizontally into an empty cell
+            return not IsActionHorz(action) or not self._is_type(coord_from_action(coord, action), kCellEmpty, action)
+        if kIsOpenGateCell[item]:
+            return not self._has_property(coord_from_action(coord, action), kPropTraversable, action)
+        return True
+
+    def _update_firefly(self, coord: Tuple[int, int]) -> None:
+        action = kCellToDirection[self._grid.item(coord)]
+        new_direction = kRotateLeftDir[action]
+        if self._is_type_adjacent(coord, kCellAgent) or self._is_type_adjacent(coord, kCellBlob):  # Exploide if touching agent/blob
+            self._explode(coord, kCellToExplosion[self._get_item(coord)])
+        elif self._is_type(coord, kCellEmpty, new_direction):  # First try to rotate left
+            self._set_item(coord, kDirectionToFireflyCell[new_direction], self._get_id(coord))
             self._move_item(coord, new_direction)
-        elif self._is_type(coord, kElEmpty, action):  # Then try to move forward
-            self._set_item(coord, kDirectionToFirefly[action], self._grid_to_id(coord))
+        elif self._is_type(coord, kCellEmpty, action):  # Then try to move forward
+            self._set_item(coord, kDirectionToFireflyCell[action], self._get_id(coord))
             self._move_item(coord, action)
         else:  # No other options, rotate right
-            self._set_item(coord, kDirectionToFirefly[kRotateRight[action]], self._grid_to_id(coord))
-
-    def _update_butterfly(self, coord: Tuple[int, int], action: Directions) -> None:
-        new_direction = kRotateRight[action]
-        if self._is_type_adjacent(coord, kElAgent) or self._is_type_adjacent(coord, kElBlob):  # Exploide if touching agent/blob
-            old_element = self._get_item(coord)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element)
-        elif self._is_type(coord, kElEmpty, new_direction):  # First try to rotate right
-            self._set_item(coord, kDirectionToButterfly[new_direction], self._grid_to_id(coord))
+            self._set_item(coord, kDirectionToFireflyCell[kRotateRightDir[action]], self._get_id(coord))
+
+    def _update_butterfly(self, coord: Tuple[int, int]) -> None:
+        action = kCellToDirection[self._grid.item(coord)]
+        new_direction = kRotateRightDir[action]
+        if self._is_type_adjacent(coord, kCellAgent) or self._is_type_adjacent(coord, kCellBlob):  # Exploide if touching agent/blob
+            self._explode(coord, kCellToExplosion[self._get_item(coord)])
+        elif self._is_type(coord, kCellEmpty, new_direction):  # First try to rotate right
+            self._set_item(coord, kDirectionToButterflyCell[new_direction], self._get_id(coord))
             self._move_item(coord, new_direction)
-        elif self._is_type(coord, kElEmpty, action):  # Then try to move forward
-            self._set_item(coord, kDirectionToButterfly[action], self._grid_to_id(coord))
+        elif self._is_type(coord, kCellEmpty, action):  # Then try to move forward
+            self._set_item(coord, kDirectionToButterflyCell[action], self._get_id(coord))
             self._move_item(coord, action)
         else:  # No other options, rotate left
-            self._set_item(coord, kDirectionToButterfly[kRotateLeft[action]], self._grid_to_id(coord))
+            self._set_item(coord, kDirectionToButterflyCell[kRotateLeftDir[action]], self._get_id(coord))
 
-    def _update_orange(self, coord: Tuple[int, int], action: Directions) -> None:
-        if self._is_type(coord, kElEmpty, action):  # Continue moving in direction
+    def _update_orange(self, coord: Tuple[int, int]) -> None:
+        action = kCellToDirection[self._grid.item(coord)]
+        if self._is_type(coord, kCellEmpty, action):  # Continue moving in direction
             self._move_item(coord, action)
-        elif self._is_type_adjacent(coord, kElAgent):  # Run into agent -> explode
-            old_element = self._get_item(coord)
-            exploded_element = kElementToExplosion[old_element] if old_element in kElementToExplosion else kElExplosionEmpty
-            self._explode(coord, exploded_element)
+        elif self._is_type_adjacent(coord, kCellAgent):  # Run into agent -> explode
+            self._explode(coord, kCellToExplosion[self._get_item(coord)])
         else:  # Blocked, roll for new direction
             open_directions = [
                 direction
-                for direction in Directions
-                if (
-                    direction != Directions.kNone
-                    and self._in_bounds(coord, direction)
-                    and self._is_type(coord, kElEmpty, direction)
-                )
+                for direction in range(kDirUp, NUM_DIRECTIONS)
+                if self._in_bounds(coord, direction) and self._is_type(coord, kCellEmpty, direction)
             ]
             # Roll for new direction
             if len(open_directions) > 0:
-                new_direction = open_directions[self._rng.choice(len(open_directions))]
-                self._set_item(coord, kDirectionToOrange[new_direction], self._grid_to_id(coord))
+                new_direction = open_directions[self._get_rng().choice(len(open_directions))]
+                self._set_item(coord, kDirectionToOrangeCell[new_direction], self._get_id(coord))
 
     def _update_magic_wall(self, coord: Tuple[int, int]) -> None:
         if self._magic_active:  # Dormant
-            self._set_item(coord, kElWallMagicOn, self._grid_to_id(coord))
+            self._set_item(coord, kCellWallMagicOn, self._get_id(coord))
         elif self._magic_wall_steps > 0:  # Active
-            self._set_item(coord, kElWallMagicDormant, self._grid_to_id(coord))
+            self._set_item(coord, kCellWallMagicDormant, self._get_id(coord))
         else:  # Expired
-            self._set_item(coord, kElWallMagicExpired, self._grid_to_id(coord))
+            self._set_item(coord, kCellWallMagicExpired, self._get_id(coord))
 
     def _update_blob(self, coord: Tuple[int, int]) -> None:
-        if self._blob_swap != kNullElement:  # Replace blob if swap element set
+        if self._blob_swap != kCellNull:  # Replace blob if swap element set
             self._increment_counter()
             self._set_item(coord, self._blob_swap, self._id_counter)
         else:
             self._blob_size += 1
-            if self._is_type_adjacent(coord, kElEmpty) or self._is_type_adjacent(
-                coord, kElDirt
+            if self._is_type_adjacent(coord, kCellEmpty) or self._is_type_adjacent(
+                coord, kCellDirt
             ):  # Check if at least one tile blob can grow
                 self._blob_enclosed = False
             # Roll if to grow and direction
-            will_grow = self._rng.integers(0, 255) < self._blob_chance
-            possible_directions = [Directions.kUp, Directions.kLeft, Directions.kDown, Directions.kRight]
-            direction_grow = possible_directions[self._rng.choice(len(possible_directions))]
-            if will_grow and (self._is_type(coord, kElEmpty, direction_grow) or self._is_type(coord, kElDirt, direction_grow)):
+            will_grow = self._get_rng().integers(0, 255) < self._blob_chance
+            possible_directions = [kDirUp, kDirLeft, kDirDown, kDirRight]
+            direction_grow = possible_directions[self._get_rng().choice(len(possible_directions))]
+            if will_grow and (self._is_type(coord, kCellEmpty, direction_grow) or self._is_type(coord, kCellDirt, direction_grow)):
                 self._increment_counter()
-                self._set_item(coord, kElBlob, self._id_counter, direction_grow)
+                self._set_item(coord, kCellBlob, self._id_counter, direction_grow)
 
     def _update_explosions(self, coord: Tuple[int, int]) -> None:
         self._increment_counter()
-        if kExplosionToElement[self._get_item(coord)] == kElDiamond:
+        cell_type = kExplosionToCell[self._get_item(coord)]
+        if cell_type == kCellDiamond:
             self._reward_signal |= RewardCodes.kRewardButterflyToDiamond
-        self._set_item(coord, kExplosionToElement[self._get_item(coord)], self._id_counter)
+        self._set_item(coord, cell_type, self._id_counter)
 
     def _start_scan(self) -> None:
         # Update global flags
@@ -471,134 +702,505 @@ class RNDGameState:
         self._reward_signal = 0
         # Reset elements
         self._has_updated[:] = False
-        self._unpack_grid()
 
     def _end_scan(self) -> None:
-        if self._blob_swap == kNullElement:  # Check if blob status
+        if self._blob_swap == kCellNull:  # Check if blob status
             if self._blob_enclosed:  # If enclosed, it becomes diamonds
-                self._blob_swap = kElDiamond
+                self._blob_swap = kCellDiamond
             elif self._blob_size > self._blob_max_size:  # If blob too large, it becomes stones
-                self._blob_swap = kElStone
+                self._blob_swap = kCellStone
         if self._magic_active:  # Reduce magic wall steps if active
             self._magic_wall_steps = max(self._magic_wall_steps - 1, 0)
         # Check if still active
         self._magic_active = self._magic_active and self._magic_wall_steps > 0
-        self._pack_grid()
 
-    def reset(self, params) -> None:
-        """Reset the state to the beginning"""
+    def reset(self, params, template: RNDMapTemplate = None) -> None:
+        """Reset the state to the beginning
+
+        Args:
+            params: Game parameters, with all keys of kDefaultGameParams
+            template: Parsed map to start from, looked up from the grid param if not given
+        """
+        if template is None:
+            template = get_map_template(params["grid"])
         self._magic_wall_steps = params["magic_wall_steps"]
         self._magic_active = False
         self._blob_size = 0
         self._blob_chance = params["blob_chance"]
         self._blob_enclosed = False
-        self._blob_swap = kNullElement
+        self._blob_swap = kCellNull
         self._gems_collected = 0
         self._current_reward = 0
         self._obs_show_ids = params["obs_show_ids"]
-        self._id_counter = 1
         self._seed = params["rng_seed"]
         self._rng = np.random.default_rng(self._seed)
-        self._parse_grid(params)
+        self._rng_state = None
+        self._undo_stack = []
+        self._undo_cells = None
+        self._obs_cache = None
+        self._obs_cache_shared = False
+        self._obs_dirty = set()
+        self._hash_ids = self._obs_show_ids if params["hash_ids"] is None else params["hash_ids"]
+        self._hash_counters = params["hash_counters"]
+
+        # Copy the starting grid and derived state from the template
+        self._template = template
+        self._rows, self._cols = template.rows, template.cols
+        self._gems_required, self._max_steps = template.gems_required, template.max_steps
+        self._blob_max_size = params["blob_max_percentage"] * self._cols * self._rows
+        if self._obs_show_ids:
+            self._set_planes(template.grid, template.ids)
+            self._id_counter = template.id_counter
+        else:
+            self._set_planes(template.grid, np.ones((self._rows, self._cols), dtype=np.uint16))
+            self._id_counter = 1
+        self._has_updated = np.zeros((self._rows, self._cols), dtype=bool)
+        self._active = set(template.active)
+        self._scan_queue = None
+        self._scan_idx = -1
+        self._type_counts = list(template.type_counts)
+        self._agent_pos = template.agent_pos
+        self._positions = {cell_type: set(idxs) for cell_type, idxs in template.positions.items()}
+        _, self._zobrist_keys, _, self._zobrist_id_keys = _get_zobrist_table(self._rows, self._cols)
+        self._zobrist = template.zobrist
+        if self._hash_ids:
+            self._zobrist ^= template.zobrist_ids if self._obs_show_ids else template.zobrist_unit_ids
         self._steps_remaining = self._max_steps
         self._reward_signal = 0
         self._gravity = params["gravity"]
+        self._min_diamond_dist = template.min_diamond_dist
+        self._max_diamond_door_dist = template.max_diamond_door_dist
 
-        # Any heuristic calculcations
-        self._unpack_grid()
-        diamon_pos = self.get_item_coords(kElDiamond) + self.get_item_coords(kElDiamondFalling)
-        agent_pos = self.get_item_coords(kElAgent)
-        exit_closed = self.get_item_coords(kElExitClosed) 
-        self._pack_grid()
-        self._min_diamond_dist = None
-        if len(diamon_pos) > 0 and len(agent_pos) > 0:
-            self._min_diamond_dist = min([l1_distance(agent_pos[0], d) for d in diamon_pos])
+    @classmethod
+    def from_template(cls, template: RNDMapTemplate, game_params: dict = None) -> "RNDGameState":
+        """Create a state at the start of a parsed map
 
-        self._max_diamond_door_dist = None
-        if len(exit_closed) > 0 and len(agent_pos) > 0:
-            self._max_diamond_door_dist = max([l1_distance(exit_closed[0], d) for d in diamon_pos])
+        Args:
+            template: Parsed map, see get_map_template
+            game_params: Game parameters to overwrite the defaults with, the grid param is not needed
+        """
+        params = dict(kDefaultGameParams)
+        params.update(game_params or {})
+        state = cls.__new__(cls)
+        state.reset(params, template)
+        return state
+
+    @classmethod
+    def from_array(cls, map_ids: np.ndarray, max_steps: int, gems_required: int, **params) -> "RNDGameState":
+        """Create a state directly from an array of HiddenCellTypes, skipping the map string
 
+        Args:
+            map_ids: (rows, cols) array of HiddenCellTypes
+            max_steps: Maximum number of steps, no limit if None or not positive
+            gems_required: Number of gems required to open the exit
+            params: Game parameters to overwrite the defaults with
+        """
+        return cls.from_template(RNDMapTemplate(map_ids, max_steps, gems_required), params)
 
-    def apply_action(self, action: int) -> None:
+    def clone(self) -> "RNDGameState":
+        """Create an independent copy of the state.
+        Only the grid, counters and rng state are copied, the map metadata is shared with the clone.
+        """
+        state = RNDGameState.__new__(RNDGameState)
+        state.__dict__.update(self.__dict__)
+        state._grid = self._grid.copy()
+        state._ids = self._ids.copy()
+        state._has_updated = self._has_updated.copy()
+        state._active = self._active.copy()
+        state._type_counts = self._type_counts.copy()
+        state._positions = {cell_type: idxs.copy() for cell_type, idxs in self._positions.items()}
+        state._rng = None
+        state._rng_state = self._get_rng_state()
+        state._undo_stack = []
+        # Observation cache is shared until either state needs to modify it
+        self._obs_cache_shared = state._obs_cache_shared = self._obs_cache is not None
+        state._obs_dirty = self._obs_dirty.copy()
+        return state
+
+    def __deepcopy__(self, memo) -> "RNDGameState":
+        return self.clone()
+
+    def _set_planes(self, grid: np.ndarray, ids: np.ndarray) -> None:
+        # Copy into the existing arrays of the same size as they may be views into a batch
+        if getattr(self, "_grid", None) is not None and self._grid.shape == grid.shape:
+            np.copyto(self._grid, grid)
+            np.copyto(self._ids, ids, casting="unsafe")
+        else:
+            self._grid = grid.astype(np.int8)
+            self._ids = ids.astype(np.uint16)
+
+    def restore(self, snapshot: "RNDGameState") -> None:
+        """Roll the state back in place to a snapshot previously taken with clone()"""
+        assert snapshot._grid.shape == self._grid.shape
+        grid, ids, has_updated = self._grid, self._ids, self._has_updated
+        self.__dict__.update(snapshot.__dict__)
+        # Copy into the existing arrays as they may be views into a batch
+        np.copyto(grid, snapshot._grid)
+        np.copyto(ids, snapshot._ids)
+        np.copyto(has_updated, snapshot._has_updated)
+        self._grid, self._ids, self._has_updated = grid, ids, has_updated
+        self._active = snapshot._active.copy()
+        self._type_counts = snapshot._type_counts.copy()
+        self._positions = {cell_type: idxs.copy() for cell_type, idxs in snapshot._positions.items()}
+        self._rng = None
+        self._rng_state = snapshot._get_rng_state()
+        self._undo_stack = []
+        snapshot._obs_cache_shared = self._obs_cache_shared = snapshot._obs_cache is not None
+        self._obs_dirty = snapshot._obs_dirty.copy()
+
+    def to_bytes(self) -> bytes:
+        """Serialize the state into a compact versioned binary record, see from_bytes"""
+        rng_state = self._get_rng_state()
+        if rng_state["bit_generator"] != "PCG64":
+            print("Error: only PCG64 rng states can be serialized.")
+            raise ValueError
+        flags = (
+            (_kRecordObsShowIds if self._obs_show_ids else 0)
+            | (_kRecordGravity if self._gravity else 0)
+            | (_kRecordHashIds if self._hash_ids else 0)
+            | (_kRecordHashCounters if self._hash_counters else 0)
+            | (_kRecordMagicActive if self._magic_active else 0)
+            | (_kRecordBlobEnclosed if self._blob_enclosed else 0)
+            | (_kRecordNoMaxSteps if self._max_steps is None else 0)
+            | (_kRecordNoStepsRemaining if self._steps_remaining is None else 0)
+            | (_kRecordNoMinDiamondDist if self._min_diamond_dist is None else 0)
+            | (_kRecordNoMaxDiamondDoorDist if self._max_diamond_door_dist is None else 0)
+        )
+        header = _kStateRecordHeader.pack(
+            kStateRecordMagic,
+            kStateRecordVersion,
+            self._rows,
+            self._cols,
+            flags,
+            self._gems_required,
+            self._max_steps or 0,
+            self._steps_remaining or 0,
+            self._gems_collected,
+            self._magic_wall_steps,
+            self._blob_chance,
+            self._blob_swap,
+            self._blob_size,
+            self._id_counter,
+            self._reward_signal,
+            self._min_diamond_dist or 0,
+            self._max_diamond_door_dist or 0,
+            self._current_reward,
+            self._blob_max_size,
+            rng_state["state"]["state"] >> 64,
+            rng_state["state"]["state"] & _kHashMask,
+            rng_state["state"]["inc"] >> 64,
+            rng_state["state"]["inc"] & _kHashMask,
+            rng_state["has_uint32"],
+            rng_state["uinteger"],
+        )
+        planes = [header, self._grid.tobytes()]
+        if self._obs_show_ids:
+            planes.append(self._ids.astype("<u2", copy=False).tobytes())
+        return b"".join(planes)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, template: RNDMapTemplate = None) -> "RNDGameState":
+        """Create a state from a record written by to_bytes.
+        The rng seed and undo history are not part of the record, so the state cannot be reset or undone past this point.
+
+        Args:
+            data: Record written by to_bytes
+            template: Parsed map the record was played on, lets the state report the map hash and starting grid
+        """
+        state = cls.__new__(cls)
+        state._load_bytes(data)
+        if template is not None:
+            if (template.rows, template.cols) != (state._rows, state._cols):
+                print("Error: template is {}x{}, state record is {}x{}.".format(
+                    template.rows, template.cols, state._rows, state._cols
+                ))
+                raise ValueError
+            state._template = template
+        return state
+
+    def _load_bytes(self, data: bytes) -> None:
+        (
+            magic,
+            version,
+            rows,
+            cols,
+            flags,
+            self._gems_required,
+            max_steps,
+            steps_remaining,
+            self._gems_collected,
+            self._magic_wall_steps,
+            self._blob_chance,
+            self._blob_swap,
+            self._blob_size,
+            self._id_counter,
+            self._reward_signal,
+            min_diamond_dist,
+            max_diamond_door_dist,
+            self._current_reward,
+            self._blob_max_size,
+            rng_state_hi,
+            rng_state_lo,
+            rng_inc_hi,
+            rng_inc_lo,
+            has_uint32,
+            uinteger,
+        ) = _kStateRecordHeader.unpack_from(data)
+        if magic != kStateRecordMagic or version != kStateRecordVersion:
+            print("Error: unknown state record version {}.".format(version))
+            raise ValueError
+        size = _kStateRecordHeader.size + rows * cols * (3 if flags & _kRecordObsShowIds else 1)
+        if len(data) != size:
+            print("Error: state record has size {}, expected {}.".format(len(data), size))
+            raise ValueError
+
+        self._rows, self._cols = rows, cols
+        self._obs_show_ids = (flags & _kRecordObsShowIds) > 0
+        self._gravity = (flags & _kRecordGravity) > 0
+        self._hash_ids = (flags & _kRecordHashIds) > 0
+        self._hash_counters = (flags & _kRecordHashCounters) > 0
+        self._magic_active = (flags & _kRecordMagicActive) > 0
+        self._blob_enclosed = (flags & _kRecordBlobEnclosed) > 0
+        self._max_steps = None if flags & _kRecordNoMaxSteps else max_steps
+        self._steps_remaining = None if flags & _kRecordNoStepsRemaining else steps_remaining
+        self._min_diamond_dist = None if flags & _kRecordNoMinDiamondDist else min_diamond_dist
+        self._max_diamond_door_dist = None if flags & _kRecordNoMaxDiamondDoorDist else max_diamond_door_dist
+        self._seed = None
+        self._template = None
+        self._rng = None
+        self._rng_state = {
+            "bit_generator": "PCG64",
+            "state": {"state": (rng_state_hi << 64) | rng_state_lo, "inc": (rng_inc_hi << 64) | rng_inc_lo},
+            "has_uint32": has_uint32,
+            "uinteger": uinteger,
+        }
+
+        offset = _kStateRecordHeader.size
+        grid = np.frombuffer(data, dtype=np.int8, count=rows * cols, offset=offset).reshape(rows, cols)
+        if self._obs_show_ids:
+            offset += rows * cols
+            ids = np.frombuffer(data, dtype="<u2", count=rows * cols, offset=offset).reshape(rows, cols)
+        else:
+            ids = np.ones((rows, cols), dtype=np.uint16)  # Every id is 1 when ids aren't shown
+        self._set_planes(grid, ids)
+        self._has_updated = np.zeros((rows, cols), dtype=bool)
+        self._undo_stack = []
+        self._undo_cells = None
+        self._obs_cache = None
+        self._obs_cache_shared = False
+        self._obs_dirty = set()
+        self._init_active()
+        self._init_zobrist()
+        self._init_tracking()
+
+    def __getstate__(self) -> tuple:
+        # The starting map is kept so that the unpickled state shares a template, and so the map analyses, with
+        # other states of the map
+        template = self._template
+        if template is None:
+            return self.to_bytes(), None
+        return self.to_bytes(), (template.grid.tobytes(), template.max_steps, template.gems_required)
+
+    def __setstate__(self, data: tuple) -> None:
+        record, starting_map = data
+        self._load_bytes(record)
+        if starting_map is not None:
+            grid_bytes, max_steps, gems_required = starting_map
+            self._template = get_grid_template(grid_bytes, self._rows, self._cols, max_steps, gems_required)
+
+    def _get_counters(self) -> tuple:
+        return (
+            self._steps_remaining,
+            self._gems_collected,
+            self._current_reward,
+            self._magic_wall_steps,
+            self._magic_active,
+            self._blob_size,
+            self._blob_enclosed,
+            self._blob_swap,
+            self._id_counter,
+            self._reward_signal,
+            self._get_rng_state(),
+        )
+
+    def _set_counters(self, counters: tuple) -> None:
+        (
+            self._steps_remaining,
+            self._gems_collected,
+            self._current_reward,
+            self._magic_wall_steps,
+            self._magic_active,
+            self._blob_size,
+            self._blob_enclosed,
+            self._blob_swap,
+            self._id_counter,
+            self._reward_signal,
+            rng_state,
+        ) = counters
+        if self._rng is None:
+            self._rng_state = rng_state
+        else:
+            self._rng.bit_generator.state = rng_state
+
+    def apply_action(self, action: int, record_undo: bool = False) -> None:
         """Perform the action and step the state forward one step
 
         Args:
             actions: Integer action code to apply
+            record_undo: Flag to record the changes made so the step can be reverted with undo_action
         """
         assert action >= 0 and action < NUM_ACTIONS
+        if record_undo:
+            self._undo_cells = []
+            self._undo_stack.append((self._get_counters(), self._undo_cells))
         self._start_scan()
 
-        # Find where agent is and update its position
-        agent_idx = np.where(self._grid[int(HiddenCellType.kAgent), :, :])
-        coord = (agent_idx[0].item(), agent_idx[1].item())
-        self._update_agent(coord, Directions(action))
+        # Update agent position if its still alive
+        if self._agent_pos is not None:
+            self._update_agent(self._agent_pos, int(action))
 
-        # Check each cell and apply respective dynamics function
-        for r in range(self._rows):
-            for c in range(self._cols):
-                element = self._get_item((r, c))
-                if self._has_updated[r, c]:
-                    continue
-                elif element == kElStone:
-                    self._update_stone((r, c))
-                elif element == kElStoneFalling:
-                    self._update_stone_falling((r, c))
-                elif element == kElDiamond:
-                    self._update_diamond((r, c))
-                elif element == kElDiamondFalling:
-                    self._update_diamond_falling((r, c))
-                elif element == kElNut:
-                    self._update_nut((r, c))
-                elif element == kElNutFalling:
-                    self._update_nut_falling((r, c))
-                elif element == kElBomb:
-                    self._update_bomb((r, c))
-                elif element == kElBombFalling:
-                    self._update_bomb_falling((r, c))
-                elif element == kElExitClosed:
-                    self._update_exit((r, c))
-                elif IsButterfly(element):
-                    self._update_butterfly((r, c), kButterflyToDirection[element])
-                elif IsFirefly(element):
-                    self._update_firefly((r, c), kFireflyToDirection[element])
-                elif IsOrange(element):
-                    self._update_orange((r, c), kOrangeToDirection[element])
-                elif IsMagicWall(element):
-                    self._update_magic_wall((r, c))
-                elif element == kElBlob:
-                    self._update_blob((r, c))
-                elif IsExplosion(element):
-                    self._update_explosions((r, c))
+        # Check each active cell in row-major order and apply respective dynamics function
+        self._scan_queue = sorted(self._active)
+        self._scan_idx = -1
+        while self._scan_queue:
+            idx = heapq.heappop(self._scan_queue)
+            if idx <= self._scan_idx:  # Already visited
+                continue
+            self._scan_idx = idx
+            coord = divmod(idx, self._cols)
+            if self._has_updated.item(coord):
+                continue
+            update_function = kCellUpdateFunctions[self._grid.item(coord)]
+            if update_function is not None:
+                update_function(self, coord)
+        self._scan_queue = None
 
         self._end_scan()
+        self._undo_cells = None
+
+    def transition_key(self, action: int) -> tuple:
+        """Get a key of everything the outcome of stepping with the action depends on, so steps with equal keys
+        give the same transition, or None if the step may draw from the rng or ids aren't part of the hash.
+        Ids are left out when they are neither observed nor hashed, as they don't change the dynamics.
+        """
+        ids_matter = self._obs_show_ids or self._hash_ids
+        if (ids_matter and not self._hash_ids) or self.may_use_rng():
+            return None
+        # Steps remaining only matter for the exit reward, when the agent walks into the exit
+        steps = self._steps_remaining is None
+        coord = self._agent_pos
+        if coord is not None and self._is_type(coord, kCellExitOpen, action):
+            steps = self._steps_remaining
+        return (
+            self._zobrist,
+            action,
+            self._rows,
+            self._cols,
+            self._gravity,
+            self._blob_max_size,
+            self._blob_swap,
+            self._magic_wall_steps,
+            self._magic_active,
+            steps,
+            # The exit opens depending on whether the gems are or will be collected this step
+            max(min(self._gems_required - self._gems_collected, 2), 0),
+            self._id_counter if ids_matter else None,
+        )
+
+    def apply_action_transition(self, action: int) -> tuple:
+        """Perform the action like apply_action, and get the transition, which apply_transition can replay
+        on any state with the same transition_key"""
+        gems_collected, id_counter = self._gems_collected, self._id_counter
+        self.apply_action(action, record_undo=True)
+        _, undo_cells = self._undo_stack.pop()
+        original = {}
+        for coord, cell_type, id in undo_cells:
+            original.setdefault(coord, (cell_type, id))
+        cells = []
+        for coord, cell_type_id in original.items():
+            new_cell_type_id = (self._grid.item(coord), self._ids.item(coord))
+            if new_cell_type_id != cell_type_id:
+                cells.append((coord,) + new_cell_type_id)
+        counters = (
+            self._current_reward,
+            self._magic_wall_steps,
+            self._magic_active,
+            self._blob_size,
+            self._blob_enclosed,
+            self._blob_swap,
+            self._reward_signal,
+        )
+        return tuple(cells), self._gems_collected - gems_collected, self._id_counter - id_counter, counters
+
+    def apply_transition(self, transition: tuple) -> None:
+        """Step forward by replaying a transition from apply_action_transition, without scanning the grid"""
+        cells, gems_collected, id_counter, counters = transition
+        for coord, cell_type, id in cells:
+            self._write_cell(coord, cell_type, id)
+        if self._steps_remaining is not None:
+            self._steps_remaining -= 1
+        self._gems_collected += gems_collected
+        self._id_counter += id_counter
+        (
+            self._current_reward,
+            self._magic_wall_steps,
+            self._magic_active,
+            self._blob_size,
+            self._blob_enclosed,
+            self._blob_swap,
+            self._reward_signal,
+        ) = counters
+
+    def undo_action(self) -> None:
+        """Revert the last step applied with record_undo set"""
+        assert len(self._undo_stack) > 0
+        counters, cells = self._undo_stack.pop()
+        for coord, cell_type, id in reversed(cells):
+            self._write_cell(coord, cell_type, id)
+        self._set_counters(counters)
 
     def is_terminal(self) -> bool:
         """Return True if the game is over, false otherwise."""
-        self._unpack_grid()
         out_of_time = self._steps_remaining is not None and self._steps_remaining <= 0
-        result = out_of_time or np.where(self._grid[int(HiddenCellType.kAgent), :, :])[0].size == 0
-        self._pack_grid()
-        return result
+        return out_of_time or self._type_counts[kCellAgent] == 0
 
     def is_solution(self) -> bool:
         """Return True if the game is solved, false otherwise."""
-        self._unpack_grid()
         out_of_time = self._steps_remaining is not None and self._steps_remaining <= 0
-        result = not out_of_time and np.where(self._grid[int(HiddenCellType.kAgentInExit), :, :])[0].size == 1
-        self._pack_grid()
-        return result
-
-    def get_observation(self) -> np.ndarray:
-        """Get the current observation as an numpy array"""
-        self._unpack_grid()
-        obs = np.zeros((NUM_VISIBLE_CELL_TYPE, self._rows, self._cols), dtype=np.float32)
-        for r in range(self._rows):
-            for c in range(self._cols):
-                grid_channel = self._grid_to_channel((r, c))
-                obs_channel = HiddenToVisibleMapping[grid_channel]
-                obs[obs_channel, r, c] = self._grid[grid_channel, r, c] if self._obs_show_ids else 1
-        self._pack_grid()
-        return obs
+        return not out_of_time and self._type_counts[kCellAgentInExit] == 1
+
+    def _update_obs_cache(self) -> None:
+        if self._obs_cache is None or len(self._obs_dirty) * 4 > self._grid.size:
+            self._obs_cache = np.zeros((NUM_VISIBLE_CELL_TYPE, self._rows, self._cols), dtype=np.float32)
+            self._obs_cache_shared = False
+            rows, cols = np.indices((self._rows, self._cols))
+            self._obs_cache[kHiddenToVisibleChannel[self._grid], rows, cols] = self._ids if self._obs_show_ids else 1
+        elif len(self._obs_dirty) > 0:
+            if self._obs_cache_shared:
+                self._obs_cache = self._obs_cache.copy()
+                self._obs_cache_shared = False
+            rows, cols = np.divmod(np.fromiter(self._obs_dirty, dtype=np.int64, count=len(self._obs_dirty)), self._cols)
+            self._obs_cache[:, rows, cols] = 0
+            self._obs_cache[kHiddenToVisibleChannel[self._grid[rows, cols]], rows, cols] = (
+                self._ids[rows, cols] if self._obs_show_ids else 1
+            )
+        self._obs_dirty.clear()
+
+    def get_observation(self, out: np.ndarray = None, dtype: np.dtype = np.float32) -> np.ndarray:
+        """Get the current observation as an numpy array
+
+        Args:
+            out: Optional preallocated array of the observation shape to write the observation into
+            dtype: Type of the returned observation if out is not given
+
+        Returns:
+            The observation, which is out if given
+        """
+        self._update_obs_cache()
+        if out is None:
+            return self._obs_cache.astype(dtype)
+        np.copyto(out, self._obs_cache, casting="unsafe")
+        return out
 
     def legal_actions(self) -> Tuple[int]:
         """Gets the current legal actions set"""
@@ -612,22 +1214,83 @@ class RNDGameState:
         """Get the current reward signal"""
         return self._reward_signal
 
+    def get_reward(self) -> float:
+        """Get the points earned on the last step"""
+        return self._current_reward
+
+    def may_use_rng(self) -> bool:
+        """Return True if a future step may draw from the rng, which only oranges and growing blobs do"""
+        counts = self._type_counts
+        if counts[kCellOrangeUp] or counts[kCellOrangeLeft] or counts[kCellOrangeDown] or counts[kCellOrangeRight]:
+            return True
+        return counts[kCellBlob] > 0 and self._blob_swap == kCellNull
+
+    def seed_rng(self, seed: int) -> None:
+        """Reseed the rng which decides orange directions and blob growth"""
+        self._rng = np.random.default_rng(seed)
+        self._rng_state = None
+
     def get_item_coords(self, element: Element) -> Tuple[Tuple[int, int]]:
-        return np.argwhere(self._grid[element.cell_type]).tolist()
+        return [list(coord) for coord in self.positions(element.cell_type)]
+
+    def positions(self, cell_type: int) -> Tuple[Tuple[int, int]]:
+        """Get the (row, col) of every item of a cell type, in row-major order.
+        Items are looked up in the position index, other than background tiles (empty, dirt, brick and steel
+        walls) which are found with a scan of the grid.
+        """
+        if kIsIndexedCell[cell_type]:
+            return [divmod(idx, self._cols) for idx in sorted(self._positions.get(cell_type, ()))]
+        return [tuple(coord) for coord in np.argwhere(self._grid == cell_type).tolist()]
+
+    def get_cell(self, coord: Tuple[int, int]) -> int:
+        """Get the cell type at (row, col)"""
+        return self._grid.item(coord[0], coord[1])
+
+    def count(self, cell_type: int) -> int:
+        """Get the number of items of a cell type"""
+        return self._type_counts[cell_type]
+
+    def get_agent_position(self) -> Tuple[int, int]:
+        """Get the (row, col) of the agent, or None if the agent is no longer on the map"""
+        return self._agent_pos
+
+    def _get_template(self) -> RNDMapTemplate:
+        if self._template is None:
+            print("Error: state was loaded with from_bytes without a template, its starting map is unknown.")
+            raise ValueError
+        return self._template
+
+    def map_hash(self) -> int:
+        """Get the 64-bit hash of the starting grid of the map.
+        States loaded with from_bytes without a template don't know their starting grid, and raise a ValueError.
+        """
+        return self._get_template().zobrist
+
+    def starting_grid(self) -> np.ndarray:
+        """Get the read-only (rows, cols) starting grid of cell types.
+        States loaded with from_bytes without a template don't know their starting grid, and raise a ValueError.
+        """
+        return self._get_template().grid
+
+    def get_gems_required(self) -> int:
+        """Get the number of gems required to open the exit"""
+        return self._gems_required
+
+    def get_gems_collected(self) -> int:
+        """Get the number of gems collected so far"""
+        return self._gems_collected
 
     def heuristic(self) -> int:
-        self._unpack_grid()
-        agent_pos = self.get_item_coords(kElAgent)
-        exit_open = self.get_item_coords(kElExitOpen)
-        exit_closed = self.get_item_coords(kElExitClosed) 
-        diamon_pos = self.get_item_coords(kElDiamond) + self.get_item_coords(kElDiamondFalling)
-        self._pack_grid()
-
-        if len(agent_pos) == 0:
+        agent_pos = self._agent_pos
+        exit_open = self.positions(kCellExitOpen)
+        exit_closed = self.positions(kCellExitClosed)
+        diamon_pos = self.positions(kCellDiamond) + self.positions(kCellDiamondFalling)
+
+        if agent_pos is None:
             return 0
         
         if len(exit_open) > 0:
-            return l1_distance(agent_pos[0], exit_open[0])
+            return l1_distance(agent_pos, exit_open[0])
 
         distance = 0
         if len(exit_closed) > 0:
@@ -638,14 +1301,122 @@ class RNDGameState:
         #     distance += len(diamon_pos) * self._min_diamond_dist
 
         if len(diamon_pos) > 0:
-            distance += len(diamon_pos) * min([l1_distance(agent_pos[0], d) for d in diamon_pos])
+            distance += len(diamon_pos) * min([l1_distance(agent_pos, d) for d in diamon_pos])
 
         return distance
 
     def __hash__(self) -> int:
-        v = self.get_observation().view(np.uint8)
-        # return hash(hashlib.sha1(v).hexdigest())
-        return int("0x{}".format(hashlib.sha1(v).hexdigest()), 0)
+        """64-bit zobrist hash of the cell types (and ids if hash_ids is set), along with the step
+        counters and rng state if hash_counters is set"""
+        if not self._hash_counters:
+            return self._zobrist
+        rng_state = self._get_rng_state()
+        counters = (
+            -1 if self._steps_remaining is None else self._steps_remaining,
+            self._gems_collected,
+            self._magic_wall_steps,
+            self._magic_active,
+            self._blob_swap,
+            self._id_counter,
+            *[v for _, v in sorted(rng_state["state"].items())],
+            rng_state["has_uint32"],
+            rng_state["uinteger"],
+        )
+        return self._zobrist ^ _mix64(hash(counters) & _kHashMask)
+
+
+# Update function for each cell type, indexed by cell type
+kCellUpdateFunctions = tuple(getattr(RNDGameState, name) if name else None for name in kCellUpdateFunction)
+
+
+class BatchedRNDGameState:
+    """Lockstep wrapper over B RNDGameStates of the same size, which is not a vectorized engine.
+
+    Stepping isn't vectorized: apply_actions steps each element with the scalar engine in turn, so stepping costs
+    the same as B scalar states (see user/bench_rnd_py.py --batch_size). The cell type and id planes of all batch
+    elements are held in shared (B, rows, cols) arrays, with each element state operating on its own view, and
+    kept in place by reset() and restore(). Observations and the terminal and solution flags are computed from
+    the batch arrays at once, rather than per element.
+    """
+
+    def __init__(self, game_params: Tuple[dict]):
+        assert len(game_params) > 0
+        self._states = [RNDGameState(params) for params in game_params]
+        shapes = set((s._rows, s._cols) for s in self._states)
+        if len(shapes) != 1:
+            print("Error: all maps in the batch must be the same size.")
+            raise ValueError
+        self._batch_size = len(self._states)
+        self._rows, self._cols = shapes.pop()
+
+        # Move the element planes into the batch arrays, element states keep views into them
+        self._grid = np.stack([s._grid for s in self._states])
+        self._ids = np.stack([s._ids for s in self._states])
+        for b, s in enumerate(self._states):
+            s._grid = self._grid[b]
+            s._ids = self._ids[b]
+        self._batch_idx, self._row_idx, self._col_idx = np.indices(self._grid.shape)
+
+    def _out_of_time(self) -> np.ndarray:
+        steps_remaining = [1 if s._steps_remaining is None else s._steps_remaining for s in self._states]
+        return np.array(steps_remaining) <= 0
+
+    def __len__(self) -> int:
+        return self._batch_size
+
+    def __getitem__(self, idx: int) -> RNDGameState:
+        return self._states[idx]
+
+    def apply_actions(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Perform one action for each batch element and step all states forward one step.
+        Each element is stepped by the scalar engine in turn, and elements which are already terminal are not stepped.
+
+        Args:
+            actions: Integer action codes of shape (B,)
+
+        Returns:
+            Stacked observations (B, C, rows, cols), reward signals (B,) and terminal flags (B,)
+        """
+        actions = np.asarray(actions)
+        assert actions.shape == (self._batch_size,)
+        for state, terminal, action in zip(self._states, self.is_terminal(), actions.tolist()):
+            if not terminal:
+                state.apply_action(action)
+        return self.get_observations(), self.get_reward_signals(), self.is_terminal()
+
+    def is_terminal(self) -> np.ndarray:
+        """Return the terminal flag of each batch element."""
+        has_agent = (self._grid == kCellAgent).any(axis=(1, 2))
+        return self._out_of_time() | ~has_agent
+
+    def is_solution(self) -> np.ndarray:
+        """Return the solution flag of each batch element."""
+        num_in_exit = np.count_nonzero(self._grid == kCellAgentInExit, axis=(1, 2))
+        return ~self._out_of_time() & (num_in_exit == 1)
+
+    def get_reward_signals(self) -> np.ndarray:
+        """Get the current reward signal of each batch element"""
+        return np.array([s._reward_signal for s in self._states], dtype=np.int64)
+
+    def get_observations(self, out: np.ndarray = None, dtype: np.dtype = np.float32) -> np.ndarray:
+        """Get the current observations as a stacked (B, C, rows, cols) numpy array, one-hot encoded from the
+        batch grid with the cell ids as values for elements which show ids
+
+        Args:
+            out: Optional preallocated array of the batched observation shape to write the observations into
+            dtype: Type of the returned observations if out is not given
+        """
+        if out is None:
+            out = np.empty(self.observation_shape(), dtype=dtype)
+        out.fill(0)
+        show_ids = np.array([s._obs_show_ids for s in self._states])
+        values = np.where(show_ids[:, None, None], self._ids, 1)
+        out[self._batch_idx, kHiddenToVisibleChannel[self._grid], self._row_idx, self._col_idx] = values
+        return out
+
+    def observation_shape(self) -> Tuple[int]:
+        """Get the batched observation shape"""
+        return (self._batch_size, NUM_VISIBLE_CELL_TYPE, self._rows, self._cols)
 
 
 def main():
@@ -382,40 +382,243 @@ kElToFalling = {
     kElBomb: kElBombFalling,
 }  # type: Dict[Element, Element]
 
+# --------------
+# Integer tables used by the engine. Cell types and directions are handled as plain ints internally,
+# as IntEnum member access and Element comparisons are slow in the per-cell update loop.
+# Cell type tables are indexed by HiddenCellType value, direction tables by Directions value.
+# --------------
+
+# Plain int cell types
+kCellNull = int(HiddenCellType.kNull)
+kCellAgent = int(HiddenCellType.kAgent)
+kCellEmpty = int(HiddenCellType.kEmpty)
+kCellDirt = int(HiddenCellType.kDirt)
+kCellStone = int(HiddenCellType.kStone)
+kCellStoneFalling = int(HiddenCellType.kStoneFalling)
+kCellDiamond = int(HiddenCellType.kDiamond)
+kCellDiamondFalling = int(HiddenCellType.kDiamondFalling)
+kCellExitClosed = int(HiddenCellType.kExitClosed)
+kCellExitOpen = int(HiddenCellType.kExitOpen)
+kCellAgentInExit = int(HiddenCellType.kAgentInExit)
+kCellFireflyUp = int(HiddenCellType.kFireflyUp)
+kCellFireflyLeft = int(HiddenCellType.kFireflyLeft)
+kCellFireflyDown = int(HiddenCellType.kFireflyDown)
+kCellFireflyRight = int(HiddenCellType.kFireflyRight)
+kCellButterflyUp = int(HiddenCellType.kButterflyUp)
+kCellButterflyLeft = int(HiddenCellType.kButterflyLeft)
+kCellButterflyDown = int(HiddenCellType.kButterflyDown)
+kCellButterflyRight = int(HiddenCellType.kButterflyRight)
+kCellWallBrick = int(HiddenCellType.kWallBrick)
+kCellWallSteel = int(HiddenCellType.kWallSteel)
+kCellWallMagicDormant = int(HiddenCellType.kWallMagicDormant)
+kCellWallMagicOn = int(HiddenCellType.kWallMagicOn)
+kCellWallMagicExpired = int(HiddenCellType.kWallMagicExpired)
+kCellBlob = int(HiddenCellType.kBlob)
+kCellExplosionDiamond = int(HiddenCellType.kExplosionDiamond)
+kCellExplosionBoulder = int(HiddenCellType.kExplosionBoulder)
+kCellExplosionEmpty = int(HiddenCellType.kExplosionEmpty)
+kCellGateRedClosed = int(HiddenCellType.kGateRedClosed)
+kCellGateRedOpen = int(HiddenCellType.kGateRedOpen)
+kCellKeyRed = int(HiddenCellType.kKeyRed)
+kCellGateBlueClosed = int(HiddenCellType.kGateBlueClosed)
+kCellGateBlueOpen = int(HiddenCellType.kGateBlueOpen)
+kCellKeyBlue = int(HiddenCellType.kKeyBlue)
+kCellGateGreenClosed = int(HiddenCellType.kGateGreenClosed)
+kCellGateGreenOpen = int(HiddenCellType.kGateGreenOpen)
+kCellKeyGreen = int(HiddenCellType.kKeyGreen)
+kCellGateYellowClosed = int(HiddenCellType.kGateYellowClosed)
+kCellGateYellowOpen = int(HiddenCellType.kGateYellowOpen)
+kCellKeyYellow = int(HiddenCellType.kKeyYellow)
+kCellNut = int(HiddenCellType.kNut)
+kCellNutFalling = int(HiddenCellType.kNutFalling)
+kCellBomb = int(HiddenCellType.kBomb)
+kCellBombFalling = int(HiddenCellType.kBombFalling)
+kCellOrangeUp = int(HiddenCellType.kOrangeUp)
+kCellOrangeLeft = int(HiddenCellType.kOrangeLeft)
+kCellOrangeDown = int(HiddenCellType.kOrangeDown)
+kCellOrangeRight = int(HiddenCellType.kOrangeRight)
+kCellPebbleInDirt = int(HiddenCellType.kPebbleInDirt)
+kCellStoneInDirt = int(HiddenCellType.kStoneInDirt)
+kCellVoidInDirt = int(HiddenCellType.kVoidInDirt)
+
+# Plain int directions
+kDirNone = int(Directions.kNone)
+kDirUp = int(Directions.kUp)
+kDirRight = int(Directions.kRight)
+kDirDown = int(Directions.kDown)
+kDirLeft = int(Directions.kLeft)
+kDirUpRight = int(Directions.kUpRight)
+kDirDownRight = int(Directions.kDownRight)
+kDirDownLeft = int(Directions.kDownLeft)
+kDirUpLeft = int(Directions.kUpLeft)
+
+# Plain int element properties
+kPropConsumable = int(ElementProperties.kConsumable)
+kPropCanExplode = int(ElementProperties.kCanExplode)
+kPropRounded = int(ElementProperties.kRounded)
+kPropTraversable = int(ElementProperties.kTraversable)
+
+
+def _cell_table(mapping: dict, default) -> tuple:
+    # Convert an Element keyed map into a tuple indexed by cell type
+    return tuple(
+        mapping.get(kHiddenCellTypeToElement[HiddenCellType(i)], default) for i in range(NUM_HIDDEN_CELL_TYPE)
+    )
+
+
+def _cell_type_table(mapping: dict, default: int = kCellNull) -> tuple:
+    # Convert an Element -> Element map into a tuple of cell types indexed by cell type
+    return tuple(el if isinstance(el, int) else int(el.cell_type) for el in _cell_table(mapping, default))
+
+
+def _cell_set_table(cell_types) -> tuple:
+    # Membership flags indexed by cell type
+    cell_types = set(int(c) for c in cell_types)
+    return tuple(i in cell_types for i in range(NUM_HIDDEN_CELL_TYPE))
+
+
+# Element properties, as int bit flags
+kCellProperties = tuple(int(ElementPropertiesMapping[HiddenCellType(i)]) for i in range(NUM_HIDDEN_CELL_TYPE))
+
+# Visible cell type for each cell type
+kCellToVisible = tuple(int(HiddenToVisibleMapping[HiddenCellType(i)]) for i in range(NUM_HIDDEN_CELL_TYPE))
+
+# Explosion left behind when an item explodes (explosions leave empty unless listed)
+kCellToExplosion = _cell_type_table(kElementToExplosion, kCellExplosionEmpty)
+
+# Item left behind once an explosion clears, null for non explosions
+kExplosionToCell = _cell_type_table(kExplosionToElement)
+
+# Magic wall conversion of falling items, null for items which don't convert
+kMagicWallConversionCell = _cell_type_table(kMagicWallConversion)
+
+# Stationary to falling items, null for items which don't fall
+kCellToFalling = _cell_type_table(kElToFalling)
+
+# Gate open conversion, null for non closed gates
+kGateOpenCell = _cell_type_table(kGateOpenMap)
+
+# Closed gate each key opens, null for non keys
+kKeyToGateCell = _cell_type_table(kKeyToGate)
+
+# Gem points, 0 for items which give no points
+kGemPointsCell = _cell_table(kGemPoints, 0)
+
+# Facing direction of fireflies, butterflies and oranges, kNone for all other items
+kCellToDirection = tuple(
+    int(d) for d in _cell_table({**kFireflyToDirection, **kButterflyToDirection, **kOrangeToDirection}, kDirNone)
+)
+
+# Creature facing each cardinal direction, only defined up to kLeft
+kDirectionToFireflyCell = tuple(
+    kCellNull if d == kDirNone else int(kDirectionToFirefly[d].cell_type) for d in range(kDirLeft + 1)
+)
+kDirectionToButterflyCell = tuple(
+    kCellNull if d == kDirNone else int(kDirectionToButterfly[d].cell_type) for d in range(kDirLeft + 1)
+)
+kDirectionToOrangeCell = tuple(
+    kCellNull if d == kDirNone else int(kDirectionToOrange[d].cell_type) for d in range(kDirLeft + 1)
+)
+
+# Rotations of the cardinal directions, only defined up to kLeft
+kRotateRightDir = tuple(int(kRotateRight[d]) for d in range(kDirLeft + 1))
+kRotateLeftDir = tuple(int(kRotateLeft[d]) for d in range(kDirLeft + 1))
+
+# Row and col offset of each direction
+kDirectionRowOffsets = tuple(kDirectionOffsets[Directions(d)][1] for d in range(NUM_DIRECTIONS))
+kDirectionColOffsets = tuple(kDirectionOffsets[Directions(d)][0] for d in range(NUM_DIRECTIONS))
+
+# Cell type group membership
+kIsFireflyCell = _cell_set_table([kCellFireflyUp, kCellFireflyLeft, kCellFireflyDown, kCellFireflyRight])
+kIsButterflyCell = _cell_set_table([kCellButterflyUp, kCellButterflyLeft, kCellButterflyDown, kCellButterflyRight])
+kIsOrangeCell = _cell_set_table([kCellOrangeUp, kCellOrangeLeft, kCellOrangeDown, kCellOrangeRight])
+kIsExplosionCell = _cell_set_table([kCellExplosionBoulder, kCellExplosionDiamond, kCellExplosionEmpty])
+kIsMagicWallCell = _cell_set_table([kCellWallMagicDormant, kCellWallMagicExpired, kCellWallMagicOn])
+kIsOpenGateCell = _cell_set_table([kCellGateRedOpen, kCellGateBlueOpen, kCellGateGreenOpen, kCellGateYellowOpen])
+kIsKeyCell = _cell_set_table([kCellKeyRed, kCellKeyBlue, kCellKeyGreen, kCellKeyYellow])
+# Cell types the agent always moves onto when walking into them
+kIsAgentEnterableCell = _cell_set_table(
+    [kCellEmpty, kCellDirt, kCellDiamond, kCellDiamondFalling, kCellExitOpen, kCellKeyRed, kCellKeyBlue, kCellKeyGreen, kCellKeyYellow]
+)
+
+# Cell types which always run their update function during a scan
+kIsAlwaysActiveCell = _cell_set_table(
+    [kCellStoneFalling, kCellDiamondFalling, kCellNutFalling, kCellBombFalling, kCellExitClosed, kCellBlob]
+    + [i for i in range(NUM_HIDDEN_CELL_TYPE) if kIsMagicWallCell[i] or kIsExplosionCell[i]]
+    + [i for i in range(NUM_HIDDEN_CELL_TYPE) if kIsFireflyCell[i] or kIsButterflyCell[i] or kIsOrangeCell[i]]
+)
+
+# Stationary cell types which can only start to fall or roll if the cell below is empty or rounded
+kIsGravityCell = _cell_set_table([kCellStone, kCellDiamond, kCellNut, kCellBomb])
+
+# Cell types which a stationary item can fall into or roll off of
+kSupportsMovementCell = tuple(
+    i == kCellEmpty or (kCellProperties[i] & kPropRounded) > 0 for i in range(NUM_HIDDEN_CELL_TYPE)
+)
+
+# Cell types kept in the per-type position index, background tiles which fill most of a map are not indexed
+kIsIndexedCell = tuple(
+    i not in (kCellEmpty, kCellDirt, kCellWallBrick, kCellWallSteel) for i in range(NUM_HIDDEN_CELL_TYPE)
+)
+
+# Name of the RNDGameState update function for each cell type, empty for items which don't update
+kCellUpdateFunction = [""] * NUM_HIDDEN_CELL_TYPE
+kCellUpdateFunction[kCellStone] = "_update_stone"
+kCellUpdateFunction[kCellStoneFalling] = "_update_stone_falling"
+kCellUpdateFunction[kCellDiamond] = "_update_diamond"
+kCellUpdateFunction[kCellDiamondFalling] = "_update_diamond_falling"
+kCellUpdateFunction[kCellNut] = "_update_nut"
+kCellUpdateFunction[kCellNutFalling] = "_update_nut_falling"
+kCellUpdateFunction[kCellBomb] = "_update_bomb"
+kCellUpdateFunction[kCellBombFalling] = "_update_bomb_falling"
+kCellUpdateFunction[kCellExitClosed] = "_update_exit"
+kCellUpdateFunction[kCellBlob] = "_update_blob"
+for _cell_type in range(NUM_HIDDEN_CELL_TYPE):
+    if kIsButterflyCell[_cell_type]:
+        kCellUpdateFunction[_cell_type] = "_update_butterfly"
+    elif kIsFireflyCell[_cell_type]:
+        kCellUpdateFunction[_cell_type] = "_update_firefly"
+    elif kIsOrangeCell[_cell_type]:
+        kCellUpdateFunction[_cell_type] = "_update_orange"
+    elif kIsMagicWallCell[_cell_type]:
+        kCellUpdateFunction[_cell_type] = "_update_magic_wall"
+    elif kIsExplosionCell[_cell_type]:
+        kCellUpdateFunction[_cell_type] = "_update_explosions"
+kCellUpdateFunction = tuple(kCellUpdateFunction)
+
+
 # Element helper functions
 def IsActionHorz(action) -> bool:
-    return action == Directions.kLeft or action == Directions.kRight
+    return action == kDirLeft or action == kDirRight
 
 
 def IsFirefly(element: Element) -> bool:
-    return element == kElFireflyUp or element == kElFireflyLeft or element == kElFireflyDown or element == kElFireflyRight
+    return kIsFireflyCell[element.cell_type]
 
 
 def IsButterfly(element: Element) -> bool:
-    return element == kElButterflyUp or element == kElButterflyLeft or element == kElButterflyDown or element == kElButterflyRight
+    return kIsButterflyCell[element.cell_type]
 
 
 def IsOrange(element: Element) -> bool:
-    return element == kElOrangeUp or element == kElOrangeLeft or element == kElOrangeDown or element == kElOrangeRight
+    return kIsOrangeCell[element.cell_type]
 
 
 def IsExplosion(element: Element) -> bool:
-    return element == kElExplosionBoulder or element == kElExplosionDiamond or element == kElExplosionEmpty
+    return kIsExplosionCell[element.cell_type]
 
 
 def IsMagicWall(element: Element) -> bool:
-    return element == kElWallMagicDormant or element == kElWallMagicExpired or element == kElWallMagicOn
+    return kIsMagicWallCell[element.cell_type]
 
 
 def IsOpenGate(element: Element) -> bool:
-    return element == kElGateRedOpen or element == kElGateBlueOpen or element == kElGateGreenOpen or element == kElGateYellowOpen
+    return kIsOpenGateCell[element.cell_type]
 
 
 def IsKey(element: Element) -> bool:
-    return element == kElKeyRed or element == kElKeyBlue or element == kElKeyGreen or element == kElKeyYellow
+    return kIsKeyCell[element.cell_type]
 
 
 def coord_from_action(coord: Tuple[int, int], action: Directions) -> Tuple[int, int]:
-    row, col = coord
-    offset = kDirectionOffsets[action]
-    return row + offset[1], col + offset[0]
+    return coord[0] + kDirectionRowOffsets[action], coord[1] + kDirectionColOffsets[action]
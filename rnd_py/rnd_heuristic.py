@@ -0,0 +1,230 @@
+import sys
+import os
+import heapq
+from collections import OrderedDict, deque
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from util.rnd_definitions import *
+from rnd_py.rnd_game_util import *
+from rnd_py.rnd_game import RNDGameState
+from rnd_py.rnd_structure import MapStructure, get_map_structure
+
+
+# Cost of entering each cell type, indexed by cell type
+kTileCosts = np.array([tile_costs_hidden[HiddenCellType(i)] for i in range(NUM_HIDDEN_CELL_TYPE)], dtype=np.float64)
+
+# Starting items which have their distance fields computed up front
+kLandmarkCellTypes = [
+    kCellExitClosed, kCellExitOpen, kCellDiamond, kCellDiamondFalling,
+    kCellGateRedClosed, kCellGateRedOpen, kCellGateBlueClosed, kCellGateBlueOpen,
+    kCellGateGreenClosed, kCellGateGreenOpen, kCellGateYellowClosed, kCellGateYellowOpen,
+    kCellKeyRed, kCellKeyBlue, kCellKeyGreen, kCellKeyYellow,
+]
+
+# Maps which have their distance fields cached, and routes cached per map, least recently used are evicted first
+kMaxCachedMaps = 64
+kMaxCachedRoutes = 1 << 16
+
+# Gates which are closed until a key of their colour is collected
+kClosedGateCellTypes = [kCellGateRedClosed, kCellGateBlueClosed, kCellGateGreenClosed, kCellGateYellowClosed]
+kKeyCellTypes = [kCellKeyRed, kCellKeyBlue, kCellKeyGreen, kCellKeyYellow]
+
+
+class DistanceFields:
+    """Distance fields over the starting layout of a map.
+    Each field holds the cost of walking from every cell to a source cell, either with a BFS of unit steps, which
+    is on the same scale as the path cost of a search, or with Dijkstra where entering a cell costs its
+    tile_costs_hidden value. Immutable walls and gates which start closed can't be walked through, though they
+    get the cost of walking from them to the source so that routes can step through a gate once it is open.
+    Fields for the exit, gates, keys and diamonds are computed up front, other sources when first requested.
+    """
+
+    def __init__(self, grid: np.ndarray, weighted: bool = False, immutable: np.ndarray = None):
+        """
+        Args:
+            grid: Starting grid of cell types
+            weighted: Flag to use tile costs instead of unit steps
+            immutable: Mask of walls which are never destroyed, found from the grid if not given
+        """
+        self._rows, self._cols = grid.shape
+        self._weighted = weighted
+        self._costs = kTileCosts[grid].ravel().tolist()
+        if immutable is None:
+            immutable = MapStructure(grid).immutable
+        blocked = immutable | np.isin(grid, kClosedGateCellTypes)
+        self._blocked = blocked.ravel().tolist()
+        # (coord, closed gate type) of each gate which starts closed and each key
+        self._gates = [
+            (tuple(coord), grid.item(*coord)) for coord in np.argwhere(np.isin(grid, kClosedGateCellTypes)).tolist()
+        ]
+        self._keys = [
+            (tuple(coord), kKeyToGateCell[grid.item(*coord)]) for coord in np.argwhere(np.isin(grid, kKeyCellTypes)).tolist()
+        ]
+        # Cost of entering each gate which starts closed
+        self._gate_costs = {
+            gate_pos: self._costs[gate_pos[0] * self._cols + gate_pos[1]] if weighted else 1.0 for gate_pos, _ in self._gates
+        }
+        self._routes = OrderedDict()
+        self._fields = {}
+        for cell_type in kLandmarkCellTypes:
+            for coord in np.argwhere(grid == cell_type).tolist():
+                self.field(coord)
+
+    def _neighbours(self, idx: int):
+        row, col = divmod(idx, self._cols)
+        if row > 0:
+            yield idx - self._cols
+        if col + 1 < self._cols:
+            yield idx + 1
+        if row + 1 < self._rows:
+            yield idx + self._cols
+        if col > 0:
+            yield idx - 1
+
+    def _dijkstra(self, source: int) -> list:
+        dist = [np.inf] * (self._rows * self._cols)
+        dist[source] = 0.0
+        queue = [(0.0, source)]
+        while queue:
+            d, idx = heapq.heappop(queue)
+            if d > dist[idx] or (self._blocked[idx] and idx != source):
+                continue
+            # Stepping from a neighbour into this cell costs this cell's tile cost
+            d += self._costs[idx]
+            for n_idx in self._neighbours(idx):
+                if d < dist[n_idx]:
+                    dist[n_idx] = d
+                    heapq.heappush(queue, (d, n_idx))
+        return dist
+
+    def _bfs(self, source: int) -> list:
+        dist = [np.inf] * (self._rows * self._cols)
+        dist[source] = 0.0
+        queue = deque([source])
+        while queue:
+            idx = queue.popleft()
+            for n_idx in self._neighbours(idx):
+                if dist[n_idx] == np.inf:
+                    dist[n_idx] = dist[idx] + 1
+                    if not self._blocked[n_idx]:
+                        queue.append(n_idx)
+        return dist
+
+    def field(self, source: Tuple[int, int]) -> np.ndarray:
+        """Get the read-only (rows, cols) field of costs from each cell to the source, inf if unreachable"""
+        idx = source[0] * self._cols + source[1]
+        field = self._fields.get(idx)
+        if field is None:
+            dist = self._dijkstra(idx) if self._weighted else self._bfs(idx)
+            field = np.array(dist, dtype=np.float64).reshape(self._rows, self._cols)
+            field.flags.writeable = False
+            self._fields[idx] = field
+        return field
+
+    def distance(self, coord: Tuple[int, int], source: Tuple[int, int]) -> float:
+        """Get the cost of walking from coord to source, not passing through any gate which starts closed"""
+        return self.field(source).item(coord[0], coord[1])
+
+    def route(self, coord: Tuple[int, int], target: Tuple[int, int], opened: frozenset) -> float:
+        """Get the cost of walking from coord to target, passing through gates which start closed once open.
+        A closed gate opens after walking to a key of its colour, so routes can go agent -> key -> gate -> target.
+        The kMaxCachedRoutes most recently used routes are cached.
+
+        Args:
+            coord: Cell to walk from
+            target: Cell to walk to
+            opened: Closed gate cell types of the gates which have already been opened
+
+        Returns:
+            The cost of the cheapest route, inf if there is none
+        """
+        if len(self._gates) == 0:
+            return self.distance(coord, target)
+        cache_key = (coord, target, opened)
+        cost = self._routes.get(cache_key)
+        if cost is not None:
+            self._routes.move_to_end(cache_key)
+            return cost
+
+        # Dijkstra over (waypoint, opened gates), waypoints being keys and gates and None standing for the target
+        best = {}
+        queue = [(0.0, 0, coord, opened)]
+        counter = 1
+        cost = np.inf
+        while queue:
+            d, _, pos, pos_opened = heapq.heappop(queue)
+            if pos is None:
+                cost = d
+                break
+            if best.get((pos, pos_opened), np.inf) < d:
+                continue
+            next_waypoints = [(target, None, pos_opened)]
+            next_waypoints += [(key, key, pos_opened | {gate}) for key, gate in self._keys if gate not in pos_opened]
+            next_waypoints += [
+                (gate_pos, gate_pos, pos_opened) for gate_pos, gate in self._gates if gate in pos_opened and gate_pos != pos
+            ]
+            # The agent jumps over a gate onto the cell past it, so entering the gate itself isn't paid for
+            jump = self._gate_costs.get(pos, 0.0)
+            for source, waypoint, next_opened in next_waypoints:
+                next_d = d + self.distance(pos, source) - jump
+                if next_d < best.get((waypoint, next_opened), np.inf):
+                    best[(waypoint, next_opened)] = next_d
+                    heapq.heappush(queue, (next_d, counter, waypoint, next_opened))
+                    counter += 1
+        self._routes[cache_key] = cost
+        if len(self._routes) > kMaxCachedRoutes:
+            self._routes.popitem(last=False)
+        return cost
+
+
+# Distance fields for each map, keyed by (map hash, weighted)
+_distance_fields = OrderedDict()
+
+
+def get_distance_fields(state: RNDGameState, weighted: bool = False) -> DistanceFields:
+    """Get the distance fields of the map the state is playing, computing them on first use.
+    Fields are kept for the kMaxCachedMaps most recently used maps.
+    """
+    key = (state.map_hash(), weighted)
+    fields = _distance_fields.get(key)
+    if fields is not None:
+        _distance_fields.move_to_end(key)
+        return fields
+    fields = _distance_fields[key] = DistanceFields(state.starting_grid(), weighted, get_map_structure(state).immutable)
+    if len(_distance_fields) > kMaxCachedMaps:
+        _distance_fields.popitem(last=False)
+    return fields
+
+
+def clear_distance_fields() -> None:
+    """Clear the distance fields cache."""
+    _distance_fields.clear()
+
+
+def distance_heuristic(state: RNDGameState, weighted: bool = False) -> float:
+    """Estimated cost to go using the map distance fields.
+    Once enough gems are collected this is the cost of the route from the agent to the exit. Otherwise the agent
+    visits the nearest diamond until it has the gems still needed, then goes to the exit, so each gem still needed
+    adds the route to it. Routes through a closed gate go by a key of its colour first.
+    """
+    agent_pos = state.get_agent_position()
+    if agent_pos is None:
+        return 0
+    fields = get_distance_fields(state, weighted)
+    exits = state.positions(kCellExitOpen) or state.positions(kCellExitClosed)
+    diamonds = state.positions(kCellDiamond) + state.positions(kCellDiamondFalling)
+    opened = frozenset(gate for gate in kClosedGateCellTypes if state.count(gate) == 0)
+    needed = min(state.get_gems_required() - state.get_gems_collected(), len(diamonds))
+    if state.count(kCellExitOpen) > 0:
+        needed = 0
+
+    cost = 0
+    pos = agent_pos
+    for _ in range(needed):
+        step_cost, pos = min((fields.route(pos, d, opened), d) for d in diamonds)
+        if step_cost == np.inf:
+            return step_cost
+        cost += step_cost
+        diamonds.remove(pos)
+    return cost + (fields.route(pos, exits[0], opened) if len(exits) > 0 else 0)
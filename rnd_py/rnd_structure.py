@@ -0,0 +1,182 @@
+import sys
+import os
+from collections import deque
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game_util import *
+from rnd_py.rnd_game import RNDGameState
+
+# Cell types which are doors between rooms, gates are never destroyed so doors stay in place
+kDoorCellTypes = [
+    kCellGateRedClosed, kCellGateRedOpen, kCellGateBlueClosed, kCellGateBlueOpen,
+    kCellGateGreenClosed, kCellGateGreenOpen, kCellGateYellowClosed, kCellGateYellowOpen,
+]
+
+# Explosions can't be set off other than by the agent dying once none of these are left
+_kExplosiveCellTypes = np.array(
+    [i for i in range(NUM_HIDDEN_CELL_TYPE) if kCellProperties[i] & kPropCanExplode and i != kCellAgent]
+)
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+class MapStructure:
+    """Static structure of a map's starting layout, which holds for every state of the map the agent is alive in.
+
+    Steel walls never change, and brick walls only change when a bomb or creature explosion reaches them. A brick
+    wall is immutable if no explosive can get within a blast of it, counting the bricks earlier blasts could open up,
+    and blast_reach marks every cell a blast could reach.
+    Rooms are the connected areas between immutable walls and doors (gates), joined into a graph by the doors.
+    Articulation points are the cells whose blocking would split the cells which aren't immutable walls.
+    All arrays are read-only as the structure is shared by every state of the map.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        self.rows, self.cols = grid.shape
+        immutable, blast_reach = self._find_immutable(grid)
+        self.immutable, self.blast_reach = _read_only(immutable), _read_only(blast_reach)
+        self.rooms, self.num_rooms = self._find_rooms(grid)
+        self.doors, self.room_graph = self._find_doors(grid)
+        self.articulation = _read_only(self._find_articulation())
+
+    def _neighbours(self, idx: int):
+        row, col = divmod(idx, self.cols)
+        if row > 0:
+            yield idx - self.cols
+        if col + 1 < self.cols:
+            yield idx + 1
+        if row + 1 < self.rows:
+            yield idx + self.cols
+        if col > 0:
+            yield idx - 1
+
+    def _components(self, passable: list, seeds: list) -> list:
+        """Get the flat indices of every passable cell 4-connected to a seed"""
+        seen = [False] * len(passable)
+        queue = deque()
+        for seed in seeds:
+            if not seen[seed]:
+                seen[seed] = True
+                queue.append(seed)
+        found = []
+        while queue:
+            idx = queue.popleft()
+            found.append(idx)
+            for n_idx in self._neighbours(idx):
+                if passable[n_idx] and not seen[n_idx]:
+                    seen[n_idx] = True
+                    queue.append(n_idx)
+        return found
+
+    def _find_immutable(self, grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        steel = grid == kCellWallSteel
+        brick = grid == kCellWallBrick
+        seeds = np.flatnonzero(np.isin(grid, _kExplosiveCellTypes)).tolist()
+        if len(seeds) == 0:
+            return steel | brick, np.zeros(grid.shape, dtype=bool)
+
+        # Grow the area explosives can reach until no further brick walls can be blasted open
+        passable = (~steel & ~brick).ravel().tolist()
+        while True:
+            reached = np.zeros(grid.size, dtype=bool)
+            reached[self._components(passable, seeds)] = True
+            # Blasts cover the 3x3 area around the explosion
+            reached = reached.reshape(grid.shape)
+            padded = np.pad(reached, 1)
+            blasted = np.zeros_like(reached)
+            for dr in range(3):
+                for dc in range(3):
+                    blasted |= padded[dr : dr + self.rows, dc : dc + self.cols]
+            opened = [idx for idx in np.flatnonzero(blasted & brick).tolist() if not passable[idx]]
+            if len(opened) == 0:
+                break
+            for idx in opened:
+                passable[idx] = True
+        return steel | (brick & ~np.array(passable).reshape(grid.shape)), blasted
+
+    def _find_rooms(self, grid: np.ndarray):
+        doors = np.isin(grid, kDoorCellTypes)
+        passable = (~self.immutable & ~doors).ravel().tolist()
+        rooms = np.full(grid.size, -1, dtype=np.int32)
+        num_rooms = 0
+        for idx in range(grid.size):
+            if passable[idx] and rooms[idx] < 0:
+                rooms[self._components(passable, [idx])] = num_rooms
+                num_rooms += 1
+        return _read_only(rooms.reshape(grid.shape)), num_rooms
+
+    def _find_doors(self, grid: np.ndarray):
+        rooms = self.rooms.ravel().tolist()
+        doors = []
+        room_graph = [[] for _ in range(self.num_rooms)]
+        for idx in np.flatnonzero(np.isin(grid, kDoorCellTypes)).tolist():
+            connected = tuple(sorted({rooms[n_idx] for n_idx in self._neighbours(idx) if rooms[n_idx] >= 0}))
+            door = len(doors)
+            doors.append((divmod(idx, self.cols), grid.item(idx // self.cols, idx % self.cols), connected))
+            for room in connected:
+                room_graph[room].extend((other, door) for other in connected if other != room)
+        return tuple(doors), tuple(tuple(edges) for edges in room_graph)
+
+    def _find_articulation(self) -> np.ndarray:
+        # Iterative Tarjan over the 4-connected graph of cells which aren't immutable walls
+        passable = (~self.immutable).ravel().tolist()
+        size = self.rows * self.cols
+        order = [-1] * size
+        low = [0] * size
+        articulation = np.zeros(size, dtype=bool)
+        counter = 0
+        for root in range(size):
+            if not passable[root] or order[root] >= 0:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            root_children = 0
+            stack = [(root, -1, self._neighbours(root))]
+            while stack:
+                idx, parent, neighbours = stack[-1]
+                for n_idx in neighbours:
+                    if not passable[n_idx] or n_idx == parent:
+                        continue
+                    if order[n_idx] < 0:
+                        order[n_idx] = low[n_idx] = counter
+                        counter += 1
+                        stack.append((n_idx, idx, self._neighbours(n_idx)))
+                        break
+                    low[idx] = min(low[idx], order[n_idx])
+                else:
+                    stack.pop()
+                    if parent < 0:
+                        continue
+                    low[parent] = min(low[parent], low[idx])
+                    if parent == root:
+                        root_children += 1
+                    elif low[idx] >= order[parent]:
+                        articulation[parent] = True
+            articulation[root] = root_children > 1
+        return articulation.reshape(self.rows, self.cols)
+
+    def room_of(self, coord: Tuple[int, int]) -> int:
+        """Get the room of a cell, or -1 for immutable walls and doors"""
+        return self.rooms.item(coord[0], coord[1])
+
+
+# Structure of each map, keyed by map hash
+_map_structures = {}
+
+
+def get_map_structure(state: RNDGameState) -> MapStructure:
+    """Get the structure of the map the state is playing, computing it on first use."""
+    key = state.map_hash()
+    structure = _map_structures.get(key)
+    if structure is None:
+        structure = _map_structures[key] = MapStructure(state.starting_grid())
+    return structure
+
+
+def clear_map_structures() -> None:
+    """Clear the map structure cache."""
+    _map_structures.clear()
@@ -0,0 +1,79 @@
+import sys
+import os
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game import RNDGameState
+
+kDefaultCacheBytes = 256 << 20
+# Rough size of a cached transition, a fixed part and a part per changed cell
+_kEntryBytes = 400
+_kCellBytes = 120
+
+
+class TransitionCache:
+    """Cache of RNDGameState steps, mapping a state's transition_key for an action to the cells and counters the
+    step changed. A hit replays the changes instead of scanning the grid.
+
+    Steps which may draw from the rng (oranges and growing blobs) are never cached, so a cached step always gives
+    the same state as stepping normally. Entries are evicted least recently used first once the rough memory
+    size of the cache goes over its cap.
+    """
+
+    def __init__(self, max_bytes: int = kDefaultCacheBytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def memory_bytes(self) -> int:
+        """Get the rough memory size of the cached transitions"""
+        return self._bytes
+
+    def apply_action(self, state: RNDGameState, action: int) -> None:
+        """Step the state with the action, replaying a cached transition if there is one"""
+        key = state.transition_key(action)
+        if key is None:
+            self.bypasses += 1
+            state.apply_action(action)
+            return
+        transition = self._entries.get(key)
+        if transition is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            state.apply_transition(transition)
+            return
+
+        self.misses += 1
+        transition = state.apply_action_transition(action)
+        self._entries[key] = transition
+        self._bytes += _kEntryBytes + _kCellBytes * len(transition[0])
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _kEntryBytes + _kCellBytes * len(evicted[0])
+            self.evictions += 1
+
+    def hit_rate(self) -> float:
+        """Get the fraction of cacheable steps which were hits"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def clear(self) -> None:
+        """Remove all transitions and reset the counters"""
+        self._entries.clear()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return "entries: {}, hits: {}, misses: {}, bypasses: {}, hit rate: {:.3f}, evictions: {}".format(
+            len(self._entries), self.hits, self.misses, self.bypasses, self.hit_rate(), self.evictions
+        )
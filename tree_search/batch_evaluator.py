@@ -0,0 +1,94 @@
+from __future__ import annotations
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Callable, List, Tuple
+
+
+class BatchEvaluator:
+    """Evaluates the observations of states in batches, for heuristics and policies which are neural networks.
+
+    Observations are stacked into a preallocated (N, C, rows, cols) buffer and evaluated with one call of the
+    evaluation function. With background set, evaluation runs on a separate thread and the next batch can be
+    submitted into a second buffer while the previous batch is still being evaluated, so filling it overlaps the
+    evaluation. Batches are evaluated one at a time in the order they were submitted.
+    """
+
+    def __init__(
+        self,
+        evaluate_fn: Callable,
+        batch_size: int,
+        observation_shape: Tuple[int, int, int],
+        dtype: np.dtype = np.float32,
+        background: bool = False,
+    ):
+        """
+        Args:
+            evaluate_fn: Function from a (n, C, rows, cols) observation array to (values, policies), where values
+                has one heuristic value per observation and policies has a row of action probabilities per
+                observation. Either can be None if not given by the evaluator.
+            batch_size: Maximum number of states per batch
+            observation_shape: (C, rows, cols) shape of the state observations
+            dtype: Type of the observation buffer
+            background: Flag to evaluate batches on a background thread
+        """
+        if batch_size < 1:
+            print("Error: batch_size must be at least 1, got {}.".format(batch_size))
+            raise ValueError
+        self.batch_size = batch_size
+        self.background = background
+        self._evaluate_fn = evaluate_fn
+        self._buffers = [np.zeros((batch_size,) + tuple(observation_shape), dtype=dtype) for _ in range(2 if background else 1)]
+        self._next_buffer = 0
+        self._futures = [None] * len(self._buffers)  # Last batch submitted with each buffer
+        self._executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.num_batches = 0
+        self.num_evaluated = 0
+
+    def _evaluate(self, observations: np.ndarray) -> Tuple[List[float], List[List[float]]]:
+        values, policies = self._evaluate_fn(observations)
+        # Copy out of anything which may alias the buffer before it is reused
+        values = None if values is None else np.asarray(values, dtype=np.float64).reshape(-1).tolist()
+        policies = None if policies is None else np.asarray(policies, dtype=np.float64).tolist()
+        return values, policies
+
+    def submit(self, states: list) -> Future:
+        """Start evaluating a batch of states, the result of the returned future is (values, policies) as lists.
+        With background set, up to two batches can be in flight, and submitting waits for the evaluation of the
+        batch which last used the same buffer to finish before filling it.
+        """
+        if len(states) > self.batch_size:
+            print("Error: batch of {} states is larger than the batch size {}.".format(len(states), self.batch_size))
+            raise ValueError
+        idx = self._next_buffer
+        self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+        if self._futures[idx] is not None:
+            wait([self._futures[idx]])
+        buffer = self._buffers[idx]
+        for i, state in enumerate(states):
+            state.get_image_representation(out=buffer[i])
+        observations = buffer[: len(states)]
+        self.num_batches += 1
+        self.num_evaluated += len(states)
+
+        if self._executor is not None:
+            self._futures[idx] = self._executor.submit(self._evaluate, observations)
+            return self._futures[idx]
+        future = Future()
+        future.set_result(self._evaluate(observations))
+        return future
+
+    def close(self) -> None:
+        """Stop the background thread"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> BatchEvaluator:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
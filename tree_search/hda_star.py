@@ -0,0 +1,305 @@
+from __future__ import annotations
+import sys
+import os
+import time
+import heapq
+import queue
+import threading
+import multiprocessing as mp
+
+from typing import TYPE_CHECKING
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tree_search.search import SearchStats
+from tree_search.transposition_table import TranspositionTable, kNoAction
+if TYPE_CHECKING:
+    from typing import List, Tuple
+    from tree_search.rnd_state_py import RNDTreeStatePy
+
+# Number of generated states sent to another worker in one message
+kDefaultBatchSize = 64
+# Number of expansions between checks of the inbox
+kExpansionsPerPoll = 32
+# Seconds an idle worker waits on its inbox before checking for termination
+_kIdleWait = 0.002
+# Seconds between checks of the expansion and time limits
+_kMonitorInterval = 0.01
+
+
+class _Worker:
+    """One HDA* worker, which owns the states whose hash maps to its index.
+
+    Termination uses a message counter and per-worker busy flags, both guarded by one lock. A message is
+    counted before it is put on a queue, and the receiver marks itself busy before uncounting it, so seeing
+    every worker idle with no messages counted under the lock means no work is left anywhere.
+
+    Once stopped, a worker keeps reading its inbox until every worker has finished writing the messages it sent,
+    as a worker exiting partway through writing a message would leave its reader blocked on the rest of it.
+    """
+
+    def __init__(
+        self, worker_id, num_workers, root, weight, inboxes, lock, busy, outstanding, incumbent, expanded, done,
+        stop, flushed, results, batch_size, table_bytes
+    ):
+        self._id = worker_id
+        self._num_workers = num_workers
+        self._root = root
+        self._weight = weight
+        self._inboxes = inboxes
+        self._lock = lock
+        self._busy = busy
+        self._outstanding = outstanding
+        self._incumbent = incumbent
+        self._expanded = expanded
+        self._done = done
+        self._stop = stop
+        self._flushed = flushed
+        self._results = results
+        self._batch_size = batch_size
+
+        self._frontier = []
+        self._closed = {} if table_bytes is None else None
+        self._table = TranspositionTable(table_bytes) if table_bytes is not None else None
+        self._outboxes = [[] for _ in range(num_workers)]
+        self._counter = 0
+        self._stats = SearchStats()
+
+    def _closed_g(self, key: int) -> int:
+        if self._table is None:
+            return self._closed.get(key)
+        entry = self._table.lookup(key)
+        return None if entry is None else entry[0]
+
+    def _push(self, state: RNDTreeStatePy, g: int, path: bytes, key: int) -> None:
+        closed_g = self._closed_g(key)
+        if closed_g is not None and closed_g <= g:
+            self._stats.duplicates += 1
+            return
+        h = state.heuristic_value()
+        if g + h >= self._incumbent.value:
+            return
+        if self._table is None:
+            self._closed[key] = g
+        else:
+            self._table.store(key, g, path[-1] if len(path) > 0 else kNoAction, -1, g)
+        self._counter += 1
+        heapq.heappush(self._frontier, (g + self._weight * h, self._counter, g, h, state, path))
+        self._stats.max_frontier = max(self._stats.max_frontier, len(self._frontier))
+
+    def _send(self, owner: int) -> None:
+        with self._lock:
+            self._outstanding.value += 1
+        self._inboxes[owner].put(self._outboxes[owner])
+        self._outboxes[owner] = []
+
+    def _flush(self) -> None:
+        for owner, outbox in enumerate(self._outboxes):
+            if len(outbox) > 0:
+                self._send(owner)
+
+    def _receive(self, records: list) -> None:
+        with self._lock:
+            self._busy[self._id] = 1
+            self._outstanding.value -= 1
+        for data, g, path in records:
+            state = self._root.from_state_bytes(data)
+            self._push(state, g, path, hash(state))
+
+    def _poll(self, timeout: float = None) -> bool:
+        """Receive every message waiting in the inbox, waiting up to timeout for the first one if given"""
+        inbox = self._inboxes[self._id]
+        received = False
+        try:
+            records = inbox.get(timeout=timeout) if timeout is not None else inbox.get_nowait()
+            while True:
+                self._receive(records)
+                received = True
+                records = inbox.get_nowait()
+        except queue.Empty:
+            pass
+        return received
+
+    def _expand(self) -> None:
+        f, _, g, h, state, path = heapq.heappop(self._frontier)
+        closed_g = self._closed_g(hash(state))
+        if closed_g is not None and closed_g < g:  # Stale entry, state was reached again with a lower cost
+            return
+        if g + h >= self._incumbent.value:
+            if self._weight == 1:
+                self._frontier.clear()  # Nothing left can beat the incumbent
+            return
+        if state.is_solution():
+            with self._lock:
+                if g < self._incumbent.value:
+                    self._incumbent.value = g
+                    self._results.put(("solution", g, path))
+            return
+
+        self._stats.expanded += 1
+        for action in state.successors():
+            child = state.clone()
+            child.apply_action(action)
+            self._stats.generated += 1
+            key = hash(child)
+            owner = key % self._num_workers
+            if owner == self._id:
+                self._push(child, g + 1, path + bytes([action]), key)
+            else:
+                self._outboxes[owner].append((child.state_bytes(), g + 1, path + bytes([action])))
+                if len(self._outboxes[owner]) >= self._batch_size:
+                    self._send(owner)
+
+    def _go_idle(self) -> None:
+        with self._lock:
+            self._busy[self._id] = 0
+            if self._outstanding.value == 0 and not any(self._busy):
+                self._done.set()
+
+    def _join_outboxes(self) -> None:
+        for owner, inbox in enumerate(self._inboxes):
+            if owner != self._id:
+                inbox.close()
+                inbox.join_thread()
+        with self._lock:
+            self._flushed.value += 1
+
+    def _finish(self) -> None:
+        """Wait for the messages this worker sent to be written, reading and dropping messages until every
+        worker has done the same"""
+        writer = threading.Thread(target=self._join_outboxes)
+        writer.start()
+        inbox = self._inboxes[self._id]
+        while self._flushed.value < self._num_workers:
+            try:
+                inbox.get(timeout=_kIdleWait)
+            except queue.Empty:
+                pass
+        writer.join()
+
+    def run(self) -> None:
+        if hash(self._root) % self._num_workers == self._id:
+            self._push(self._root, 0, b"", hash(self._root))
+
+        while not self._done.is_set() and not self._stop.is_set():
+            self._poll()
+            if len(self._frontier) > 0:
+                for _ in range(kExpansionsPerPoll):
+                    if len(self._frontier) == 0:
+                        break
+                    self._expand()
+                self._flush()
+                self._expanded[self._id] = self._stats.expanded
+                continue
+            self._flush()
+            self._go_idle()
+            while not self._done.is_set() and not self._stop.is_set():
+                if self._poll(_kIdleWait):
+                    break
+
+        self._finish()
+        stats = self._stats
+        self._results.put(("stats", stats.expanded, stats.generated, stats.duplicates, stats.max_frontier))
+
+
+def _run_worker(*args) -> None:
+    _Worker(*args).run()
+
+
+def hda_star(
+    root: RNDTreeStatePy,
+    num_workers: int,
+    weight: float = 1.0,
+    max_expansions: int = None,
+    time_limit: float = None,
+    batch_size: int = kDefaultBatchSize,
+    table_bytes: int = None,
+) -> Tuple[List[int], SearchStats]:
+    """Hash distributed A* over worker processes.
+
+    Each worker runs A* over the states whose hash maps to it, and generated states owned by another worker
+    are sent to it in batches of state_bytes records along with their path cost and actions. A solution found
+    by any worker bounds the others, and the search ends once no worker has a node which could beat it.
+
+    Args:
+        root: Starting state
+        num_workers: Number of worker processes
+        weight: Heuristic weight, the returned solution is only optimal for a weight of 1 and admissible heuristic
+        max_expansions: Maximum number of node expansions across all workers before giving up
+        time_limit: Maximum seconds to search for before giving up
+        batch_size: Number of states per message sent between workers
+        table_bytes: Memory cap of each worker's closed set as a TranspositionTable, or None for an unbounded dict
+
+    Returns:
+        The actions from the root to a solution (None if not found) and the search statistics summed over workers
+    """
+    if num_workers < 1:
+        print("Error: num_workers must be at least 1, got {}.".format(num_workers))
+        raise ValueError
+    start_time = time.perf_counter()
+    ctx = mp.get_context()
+    inboxes = [ctx.Queue() for _ in range(num_workers)]
+    lock = ctx.Lock()
+    busy = ctx.Array("b", [1] * num_workers, lock=False)
+    outstanding = ctx.Value("q", 0, lock=False)
+    incumbent = ctx.Value("d", float("inf"), lock=False)
+    expanded = ctx.Array("q", num_workers, lock=False)
+    done = ctx.Event()
+    stop = ctx.Event()
+    flushed = ctx.Value("i", 0, lock=False)
+    results = ctx.Queue()
+
+    workers = [
+        ctx.Process(
+            target=_run_worker,
+            args=(
+                i, num_workers, root, weight, inboxes, lock, busy, outstanding, incumbent, expanded, done, stop,
+                flushed, results, batch_size, table_bytes,
+            ),
+            daemon=True,
+        )
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    while not done.wait(_kMonitorInterval):
+        if max_expansions is not None and sum(expanded) >= max_expansions:
+            break
+        if time_limit is not None and time.perf_counter() - start_time > time_limit:
+            break
+    stop.set()
+
+    stats = SearchStats()
+    solution = None
+    num_reported = 0
+    while num_reported < num_workers:
+        message = results.get()
+        if message[0] == "solution":
+            if solution is None or message[1] < stats.solution_cost:
+                stats.solution_cost, solution = message[1], list(message[2])
+        else:
+            num_reported += 1
+            stats.expanded += message[1]
+            stats.generated += message[2]
+            stats.duplicates += message[3]
+            stats.max_frontier += message[4]
+    for worker in workers:
+        worker.join()
+    stats.time = time.perf_counter() - start_time
+    return solution, stats
+
+
+def main():
+    from tree_search.rnd_state_py import RNDTreeStatePy
+
+    print("Paste map string: ")
+    sentinel = ""
+    map_str = "\n".join(iter(input, sentinel))
+    num_workers = int(input("Number of workers: "))
+    actions, stats = hda_star(RNDTreeStatePy(map_str), num_workers, max_expansions=100000)
+    print("HDA*: {}".format(stats))
+    print("Solution: {}".format(actions))
+
+
+if __name__ == "__main__":
+    main()
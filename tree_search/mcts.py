@@ -0,0 +1,284 @@
+from __future__ import annotations
+import sys
+import os
+import math
+import time
+import multiprocessing as mp
+import numpy as np
+
+from typing import TYPE_CHECKING
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game import RNDGameState
+from rnd_py.rnd_game_util import NUM_ACTIONS
+from rnd_py.rnd_transition_cache import TransitionCache
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List, Tuple
+
+kDefaultRolloutDepth = 50
+kDefaultDiscount = 0.99
+
+
+class MCTSNode:
+    """Open-loop search tree node, which stands for the action sequence leading to it rather than one state.
+    States are never stored in the tree, each simulation replays the actions from a clone of the root state.
+    """
+
+    def __init__(self, prior: float = 1.0):
+        self.prior = prior
+        self.visits = 0
+        self.value_sum = 0.0
+        self.children = None  # Dict of action to MCTSNode once expanded
+
+    def value(self) -> float:
+        return self.value_sum / self.visits if self.visits > 0 else 0.0
+
+
+class MCTS:
+    """Monte Carlo tree search over RNDGameState, with UCT or PUCT selection and random or policy rollouts.
+
+    Orange directions and blob growth are drawn from the state's rng, which a clone copies, so replaying the
+    same actions from one clone would always give the same outcome. While a state may still draw from its rng,
+    each simulation reseeds its clone of the root, and since the tree is open-loop a node's value averages
+    over the outcomes of its action sequence.
+
+    A child's value is the discounted return of taking its action from its parent, including the reward of that
+    step. As rewards are in points, UCT and PUCT both scale values into [0, 1] with the lowest and highest values
+    backed up so far, so that the exploration constant means the same in both and is comparable to the values.
+    """
+
+    def __init__(
+        self,
+        state: RNDGameState,
+        c: float = 1.4,
+        use_puct: bool = False,
+        prior_fn: Callable = None,
+        value_fn: Callable = None,
+        rollout_policy: Callable = None,
+        rollout_depth: int = kDefaultRolloutDepth,
+        discount: float = kDefaultDiscount,
+        seed: int = 0,
+        transition_cache: TransitionCache = None,
+    ):
+        """
+        Args:
+            state: State to search from, which is not modified
+            c: Exploration constant
+            use_puct: Flag to select with PUCT instead of UCT
+            prior_fn: Action probabilities of a state used by PUCT, uniform if None
+            value_fn: Value of a leaf state used instead of a rollout, or None to roll out
+            rollout_policy: Action of a state during rollouts given (state, rng), uniformly random if None
+            rollout_depth: Maximum number of steps per rollout
+            discount: Discount applied to rewards per step
+            seed: Seed for rollouts and reseeding the state rng
+            transition_cache: Cache of steps, which saves replaying the tree actions of each simulation
+        """
+        self._state = state.clone()
+        self._c = c
+        self._use_puct = use_puct
+        self._prior_fn = prior_fn
+        self._value_fn = value_fn
+        self._rollout_policy = rollout_policy
+        self._rollout_depth = rollout_depth
+        self._discount = discount
+        self._rng = np.random.default_rng(seed)
+        self._transition_cache = transition_cache
+        self.root = MCTSNode()
+        self.num_simulations = 0
+        self.num_steps = 0
+        self._min_value = math.inf
+        self._max_value = -math.inf
+
+    def _expand(self, node: MCTSNode, state: RNDGameState) -> None:
+        if self._use_puct and self._prior_fn is not None:
+            priors = self._prior_fn(state)
+            node.children = {action: MCTSNode(float(priors[action])) for action in range(NUM_ACTIONS)}
+        else:
+            node.children = {action: MCTSNode(1.0 / NUM_ACTIONS) for action in range(NUM_ACTIONS)}
+
+    def _normalize(self, node: MCTSNode) -> float:
+        if node.visits == 0 or self._max_value <= self._min_value:
+            return 0.0
+        return (node.value() - self._min_value) / (self._max_value - self._min_value)
+
+    def _select(self, node: MCTSNode) -> Tuple[int, MCTSNode]:
+        best_score, best = -math.inf, None
+        if self._use_puct:
+            scale = self._c * math.sqrt(node.visits)
+            for action, child in node.children.items():
+                score = self._normalize(child) + scale * child.prior / (1 + child.visits)
+                if score > best_score:
+                    best_score, best = score, (action, child)
+            return best
+        log_visits = math.log(node.visits) if node.visits > 0 else 0.0
+        for action, child in node.children.items():
+            if child.visits == 0:
+                return action, child
+            score = self._normalize(child) + self._c * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best_score, best = score, (action, child)
+        return best
+
+    def _apply_action(self, state: RNDGameState, action: int) -> None:
+        if self._transition_cache is not None:
+            self._transition_cache.apply_action(state, action)
+        else:
+            state.apply_action(action)
+
+    def _rollout(self, state: RNDGameState) -> float:
+        total, discount = 0.0, 1.0
+        if self._rollout_policy is None:
+            actions = self._rng.integers(0, NUM_ACTIONS, size=self._rollout_depth).tolist()
+        for i in range(self._rollout_depth):
+            if state.is_terminal():
+                break
+            action = actions[i] if self._rollout_policy is None else self._rollout_policy(state, self._rng)
+            self._apply_action(state, action)
+            total += discount * state.get_reward()
+            discount *= self._discount
+            self.num_steps += 1
+        return total
+
+    def simulate(self) -> None:
+        """Run one simulation, selecting down the tree, expanding a leaf, evaluating it and backing up its return"""
+        state = self._state.clone()
+        if state.may_use_rng():
+            state.seed_rng(int(self._rng.integers(1 << 63)))
+        node = self.root
+        path = [node]
+        rewards = []
+        while node.children is not None and not state.is_terminal():
+            action, node = self._select(node)
+            self._apply_action(state, action)
+            self.num_steps += 1
+            rewards.append(state.get_reward())
+            path.append(node)
+
+        value = 0.0
+        if not state.is_terminal():
+            self._expand(node, state)
+            value = self._value_fn(state) if self._value_fn is not None else self._rollout(state)
+
+        # Back up the discounted return into each node on the path, including the reward of the step into it,
+        # so a child's value is the value of taking its action from its parent
+        for node, reward in zip(reversed(path[1:]), reversed(rewards)):
+            value = reward + self._discount * value
+            node.visits += 1
+            node.value_sum += value
+            self._min_value = min(self._min_value, node.value())
+            self._max_value = max(self._max_value, node.value())
+        self.root.visits += 1
+        self.root.value_sum += value
+        self.num_simulations += 1
+
+    def search(self, num_simulations: int = None, time_limit: float = None) -> None:
+        """Run simulations until either the simulation count or time limit is reached"""
+        if num_simulations is None and time_limit is None:
+            print("Error: either num_simulations or time_limit must be given.")
+            raise ValueError
+        start_time = time.perf_counter()
+        i = 0
+        while num_simulations is None or i < num_simulations:
+            if time_limit is not None and time.perf_counter() - start_time > time_limit:
+                break
+            self.simulate()
+            i += 1
+
+    def root_stats(self) -> Dict[int, Tuple[int, float]]:
+        """Get the (visits, value sum) of each action at the root"""
+        if self.root.children is None:
+            return {}
+        return {action: (child.visits, child.value_sum) for action, child in self.root.children.items()}
+
+    def best_action(self) -> int:
+        """Get the most visited action at the root"""
+        return _most_visited(self.root_stats())
+
+    def advance(self, action: int, state: RNDGameState = None) -> None:
+        """Move the root to the child of an action, keeping its subtree for the next search.
+
+        Args:
+            action: Action taken from the root
+            state: State reached by the action, if not given the action is applied to the root state
+        """
+        if state is None:
+            state = self._state
+            state.apply_action(action)
+        else:
+            state = state.clone()
+        self._state = state
+        child = self.root.children.get(action) if self.root.children is not None else None
+        self.root = child if child is not None else MCTSNode()
+
+
+def _most_visited(stats: Dict[int, Tuple[int, float]]) -> int:
+    if len(stats) == 0:
+        return 0
+    return max(stats, key=lambda action: (stats[action][0], stats[action][1]))
+
+
+def _root_parallel_worker(state: RNDGameState, seed: int, num_simulations: int, time_limit: float, kwargs: dict):
+    mcts = MCTS(state, seed=seed, **kwargs)
+    mcts.search(num_simulations, time_limit)
+    return mcts.root_stats(), mcts.num_simulations, mcts.num_steps
+
+
+def root_parallel_search(
+    state: RNDGameState,
+    num_workers: int,
+    num_simulations: int = None,
+    time_limit: float = None,
+    seed: int = 0,
+    **kwargs,
+) -> Tuple[int, Dict[int, Tuple[int, float]], int, int]:
+    """Root parallel MCTS, where each worker process searches its own tree from the state with its own seed
+    and the root statistics of the trees are summed.
+
+    Args:
+        state: State to search from
+        num_workers: Number of worker processes
+        num_simulations: Simulations per worker
+        time_limit: Seconds per worker
+        seed: Base seed, worker i uses seed + i
+        kwargs: MCTS arguments, any functions must be picklable
+
+    Returns:
+        The most visited action, the summed (visits, value sum) of each root action and the total number of
+        simulations and steps
+    """
+    ctx = mp.get_context()
+    with ctx.Pool(num_workers) as pool:
+        results = pool.starmap(
+            _root_parallel_worker,
+            [(state, seed + i, num_simulations, time_limit, kwargs) for i in range(num_workers)],
+        )
+    stats = {}
+    num_total_simulations, num_total_steps = 0, 0
+    for root_stats, num_worker_simulations, num_worker_steps in results:
+        for action, (visits, value_sum) in root_stats.items():
+            total_visits, total_value = stats.get(action, (0, 0.0))
+            stats[action] = (total_visits + visits, total_value + value_sum)
+        num_total_simulations += num_worker_simulations
+        num_total_steps += num_worker_steps
+    return _most_visited(stats), stats, num_total_simulations, num_total_steps
+
+
+def main():
+    print("Paste map string: ")
+    sentinel = ""
+    map_str = "\n".join(iter(input, sentinel))
+    state = RNDGameState({"grid": map_str})
+    mcts = MCTS(state)
+    actions = []
+    while not state.is_terminal() and len(actions) < 100:
+        mcts.search(num_simulations=500)
+        action = mcts.best_action()
+        state.apply_action(action)
+        mcts.advance(action, state)
+        actions.append(action)
+    print("Actions: {}".format(actions))
+    print("Solved: {}".format(state.is_solution()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,50 @@
 from __future__ import annotations
 import sys
 import os
-import copy
+import struct
 import numpy as np
 
 from typing import TYPE_CHECKING
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from rnd_py.rnd_game import RNDGameState
+from rnd_py.rnd_game import RNDGameState, get_map_template
+from rnd_py.rnd_heuristic import distance_heuristic
+from rnd_py.rnd_deadlock import is_dead
+from rnd_py.rnd_transition_cache import TransitionCache
 from util.rnd_definitions import RewardCodes
 if TYPE_CHECKING:
     from typing import Tuple
 
+# Pickle record, a fixed size header of (magic, version, flags, step, map string length) followed by the
+# map string and the RNDGameState record
+kTreeStateRecordMagic = b"RNDT"
+kTreeStateRecordVersion = 1
+_kTreeStateRecordHeader = struct.Struct("<4sHBII")
+
+# Record written by state_bytes, the step followed by the RNDGameState record
+_kStepRecordHeader = struct.Struct("<I")
+
 
 class RNDTreeStatePy:
 
-    def __init__(self, map_str: str, obs_show_ids: bool = False, same_obs_equal=True, use_noop=True):
+    def __init__(
+        self,
+        map_str: str,
+        obs_show_ids: bool = False,
+        same_obs_equal=True,
+        use_noop=True,
+        use_distance_heuristic=False,
+        transition_cache: TransitionCache = None,
+    ):
         self._env_configs = {"grid": map_str, "obs_show_ids": obs_show_ids}
         self._state = RNDGameState(self._env_configs)
         self._use_noop = use_noop
         self._show_ids = obs_show_ids
         self._step = 0
         self._same_obs_equal = same_obs_equal
+        self._use_distance_heuristic = use_distance_heuristic
+        # Shared by clones, not kept when pickled
+        self._transition_cache = transition_cache
         # self._state_tensor = self.get_image_representation()
 
     def _get_reward_code(self):
@@ -33,6 +56,15 @@ class RNDTreeStatePy:
             return []
         return [i for i in range(RNDTreeStatePy.num_actions())]
     
+    def distinct_successors(self):
+        """Get one action per distinct next state.
+        Actions where the agent stays put, such as walking into a wall or pushing a blocked stone, have the same
+        outcome as the noop action and are left out, which is found before stepping.
+        """
+        if self._state.is_terminal() and not self._state.is_solution():
+            return []
+        return [0] + [action for action in range(1, RNDTreeStatePy.num_actions()) if not self._state.is_agent_noop(action)]
+
     @staticmethod
     def num_actions() -> int:
         return 5
@@ -46,21 +78,87 @@ class RNDTreeStatePy:
     def is_terminal(self):
         return self._state.is_terminal()
     
-    def apply_action(self, action):
+    def apply_action(self, action, record_undo: bool = False):
         self._step += 1
-        self._state.apply_action(action)
+        if self._transition_cache is not None and not record_undo:
+            self._transition_cache.apply_action(self._state, action)
+        else:
+            self._state.apply_action(action, record_undo)
         # self._state_tensor = self.get_image_representation()
+
+    def undo_action(self):
+        self._step -= 1
+        self._state.undo_action()
     
-    def get_image_representation(self):
-        return self._state.get_observation()
+    def get_image_representation(self, out: np.ndarray = None, dtype: np.dtype = np.float32):
+        return self._state.get_observation(out=out, dtype=dtype)
     
+    def is_dead(self) -> bool:
+        """Return True if the state can never reach a solution, so its subtree can be pruned"""
+        return is_dead(self._state)
+
     def heuristic_value(self) -> int:
+        if self._use_distance_heuristic:
+            return distance_heuristic(self._state)
         return self._state.heuristic()
     
     def reset(self):
         self._step = 0
         self._state = RNDGameState(self._env_configs)
 
+    def clone(self) -> RNDTreeStatePy:
+        state = RNDTreeStatePy.__new__(RNDTreeStatePy)
+        state.__dict__.update(self.__dict__)
+        state._state = self._state.clone()
+        return state
+
+    def restore(self, snapshot: RNDTreeStatePy):
+        self._step = snapshot._step
+        self._state.restore(snapshot._state)
+
+    def __getstate__(self) -> bytes:
+        map_str = self._env_configs["grid"].encode()
+        flags = (
+            (1 if self._show_ids else 0)
+            | (2 if self._same_obs_equal else 0)
+            | (4 if self._use_noop else 0)
+            | (8 if self._use_distance_heuristic else 0)
+        )
+        header = _kTreeStateRecordHeader.pack(
+            kTreeStateRecordMagic, kTreeStateRecordVersion, flags, self._step, len(map_str)
+        )
+        return b"".join([header, map_str, self._state.to_bytes()])
+
+    def __setstate__(self, data: bytes):
+        magic, version, flags, self._step, map_str_len = _kTreeStateRecordHeader.unpack_from(data)
+        if magic != kTreeStateRecordMagic or version != kTreeStateRecordVersion:
+            print("Error: unknown tree state record version {}.".format(version))
+            raise ValueError
+        offset = _kTreeStateRecordHeader.size
+        self._show_ids = (flags & 1) > 0
+        self._same_obs_equal = (flags & 2) > 0
+        self._use_noop = (flags & 4) > 0
+        self._use_distance_heuristic = (flags & 8) > 0
+        self._transition_cache = None
+        self._env_configs = {"grid": data[offset : offset + map_str_len].decode(), "obs_show_ids": self._show_ids}
+        self._state = RNDGameState.from_bytes(
+            data[offset + map_str_len :], get_map_template(self._env_configs["grid"])
+        )
+
+    def state_bytes(self) -> bytes:
+        """Serialize the step and game state without the map and configs, see from_state_bytes"""
+        return _kStepRecordHeader.pack(self._step) + self._state.to_bytes()
+
+    def from_state_bytes(self, data: bytes) -> RNDTreeStatePy:
+        """Create a state with the same map and configs as this state from a record written by state_bytes"""
+        state = RNDTreeStatePy.__new__(RNDTreeStatePy)
+        state.__dict__.update(self.__dict__)
+        (state._step,) = _kStepRecordHeader.unpack_from(data)
+        state._state = RNDGameState.from_bytes(
+            data[_kStepRecordHeader.size :], get_map_template(self._env_configs["grid"])
+        )
+        return state
+
     def __hash__(self):
         if self._same_obs_equal:
             return hash(self._state)
@@ -97,7 +195,7 @@ def main():
     state1 = RNDTreeStatePy(map_str, 1, same_obs_equal=same_obs_equal)
     state2 = RNDTreeStatePy(map_str, 1, same_obs_equal=same_obs_equal)
 
-    state2 = copy.deepcopy(state1)
+    state2 = state1.clone()
 
     print(state1 == state2)
     print("hash s1 {}".format(hash(state1)))
@@ -127,7 +225,7 @@ def main():
     print("hash s1 {}".format(hash(state1)))
     print("hash s2 {}".format(hash(state2)))
 
-    state1 = copy.deepcopy(state2)
+    state1 = state2.clone()
     print(state1 == state2)
 
 
@@ -1,11 +1,11 @@
 from __future__ import annotations
 import sys
 import os
-import copy
-import pickle
+import struct
 import pyspiel
 import hashlib
 import numpy as np
+from open_spiel.python.observation import make_observation
 
 from typing import TYPE_CHECKING
 
@@ -15,17 +15,49 @@ from util.rnd_util import pack_flat_map_str
 if TYPE_CHECKING:
     from typing import Tuple
 
+# Pickle record, a fixed size header of (magic, version, flags, reward structure, map string length, serialized
+# state length) followed by the map string and the open_spiel serialized state
+kTreeStateRecordMagic = b"RNDO"
+kTreeStateRecordVersion = 1
+_kTreeStateRecordHeader = struct.Struct("<4sHBiII")
+
+# Loaded games and their observations, shared by all states of the same map in this process
+_games = {}
+_observations = {}
+
+# Bytes of the digests used to hash and compare states
+_kDigestSize = 16
+
+
+def _load_game(map_str: str, reward_structure: int):
+    if (map_str, reward_structure) not in _games:
+        env_configs = {"grid": map_str, "obs_show_ids": True, "reward_structure": reward_structure}
+        _games[(map_str, reward_structure)] = pyspiel.load_game("stones_and_gems", env_configs)
+    return _games[(map_str, reward_structure)]
+
+
+def _load_observation(map_str: str, reward_structure: int):
+    """Get the observation of a game, whose tensor is a reusable buffer states write their observations into"""
+    if (map_str, reward_structure) not in _observations:
+        _observations[(map_str, reward_structure)] = make_observation(_load_game(map_str, reward_structure))
+    return _observations[(map_str, reward_structure)]
+
+
+def _digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=_kDigestSize).digest()
+
 
 class RNDTreeStateSpiel:
 
     def __init__(self, map_str: str, reward_structure: int = 0, obs_show_ids: bool = True, same_obs_equal=True):
-        env_configs = {"grid": map_str, "obs_show_ids": True, "reward_structure": reward_structure}
-        game = pyspiel.load_game("stones_and_gems", env_configs)
+        self._map_str = map_str
+        self._reward_structure = reward_structure
+        game = _load_game(map_str, reward_structure)
         self._state = game.new_initial_state()
         self._show_ids = obs_show_ids
         self._same_obs_equal = same_obs_equal
         self._observation_shape = game.observation_tensor_shape()
-        self._state_tensor = self._timestep_to_state()
+        self._digest = None
         self._sample_external_events()
 
     def _sample_external_events(self):
@@ -33,11 +65,21 @@ class RNDTreeStateSpiel:
             if self._state.is_chance_node():
                 self._state.apply_action(0)
 
-    def _timestep_to_state(self):
-        state = np.array(self._state.observation_tensor(0), dtype="uint16").reshape(self._observation_shape)
-        if not self._show_ids:
-            state = np.array(state > 0, dtype="uint8")
-        return state
+    def _observation_tensor(self) -> np.ndarray:
+        """Write the observation into the shared buffer of the game and get it, valid until another state writes"""
+        observation = _load_observation(self._map_str, self._reward_structure)
+        observation.set_from(self._state, 0)
+        tensor = observation.tensor.reshape(self._observation_shape)
+        return tensor if self._show_ids else tensor > 0
+
+    def _get_digest(self) -> bytes:
+        """Digest of the observation, or of the serialized state if states with the same observation differ"""
+        if self._digest is None:
+            if self._same_obs_equal:
+                self._digest = _digest(np.ascontiguousarray(self._observation_tensor()))
+            else:
+                self._digest = _digest(self._state.serialize().encode())
+        return self._digest
 
     def _get_reward_code(self):
         return int(self._state.rewards()[0])
@@ -64,10 +106,22 @@ class RNDTreeStateSpiel:
     def apply_action(self, action):
         self._state.apply_action(action)
         self._sample_external_events()
-        self._state_tensor = self._timestep_to_state()
+        self._digest = None
     
-    def get_image_representation(self):
-        return self._timestep_to_state()
+    def get_image_representation(self, out: np.ndarray = None) -> np.ndarray:
+        """Get the observation, computed when asked for rather than on every action
+
+        Args:
+            out: Optional preallocated array of the observation shape to write the observation into
+
+        Returns:
+            The observation, which is out if given, otherwise a uint16 array of ids or uint8 array if ids aren't shown
+        """
+        tensor = self._observation_tensor()
+        if out is None:
+            return tensor.astype("uint16" if self._show_ids else "uint8")
+        np.copyto(out, tensor, casting="unsafe")
+        return out
     
     def heuristic_value(self):
         pass
@@ -75,17 +129,44 @@ class RNDTreeStateSpiel:
     def reset(self):
         pass
 
+    def clone(self) -> RNDTreeStateSpiel:
+        state = RNDTreeStateSpiel.__new__(RNDTreeStateSpiel)
+        state.__dict__.update(self.__dict__)
+        state._state = self._state.clone()
+        return state
+
+    def __deepcopy__(self, memo) -> RNDTreeStateSpiel:
+        return self.clone()
+
+    def __getstate__(self) -> bytes:
+        map_str = self._map_str.encode()
+        serialized = self._state.serialize().encode()
+        flags = (1 if self._show_ids else 0) | (2 if self._same_obs_equal else 0)
+        header = _kTreeStateRecordHeader.pack(
+            kTreeStateRecordMagic, kTreeStateRecordVersion, flags, self._reward_structure, len(map_str), len(serialized)
+        )
+        return b"".join([header, map_str, serialized])
+
+    def __setstate__(self, data: bytes):
+        magic, version, flags, self._reward_structure, map_str_len, serialized_len = _kTreeStateRecordHeader.unpack_from(data)
+        if magic != kTreeStateRecordMagic or version != kTreeStateRecordVersion:
+            print("Error: unknown tree state record version {}.".format(version))
+            raise ValueError
+        offset = _kTreeStateRecordHeader.size
+        self._show_ids = (flags & 1) > 0
+        self._same_obs_equal = (flags & 2) > 0
+        self._map_str = data[offset : offset + map_str_len].decode()
+        serialized = data[offset + map_str_len : offset + map_str_len + serialized_len].decode()
+        game = _load_game(self._map_str, self._reward_structure)
+        self._state = game.deserialize_state(serialized)
+        self._observation_shape = game.observation_tensor_shape()
+        self._digest = None
+
     def __hash__(self):
-        if self._same_obs_equal:
-            return hash(hashlib.sha1(self._state_tensor).hexdigest())
-        else:
-            return hash(self._state.serialize())
+        return hash(int.from_bytes(self._get_digest()[:8], "little"))
 
     def __eq__(self, other):
-        if self._same_obs_equal:
-            return np.array_equal(self._state_tensor, other._state_tensor)
-        else:
-            return self._state.serialize() == other._state.serialize()
+        return self._get_digest() == other._get_digest()
 
 
 def main():
@@ -109,7 +190,7 @@ def main():
     state1 = RNDTreeStateSpiel(map_str, 1, same_obs_equal=same_obs_equal)
     state2 = RNDTreeStateSpiel(map_str, 1, same_obs_equal=same_obs_equal)
 
-    state2 = copy.deepcopy(state1)
+    state2 = state1.clone()
 
     print(state1 == state2)
     print("hash s1 {}".format(hash(state1)))
@@ -139,7 +220,7 @@ def main():
     print("hash s1 {}".format(hash(state1)))
     print("hash s2 {}".format(hash(state2)))
 
-    state1 = copy.deepcopy(state2)
+    state1 = state2.clone()
     print(state1 == state2)
 
 
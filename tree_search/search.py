@@ -0,0 +1,435 @@
+from __future__ import annotations
+import sys
+import os
+import math
+import time
+import heapq
+from array import array
+
+from typing import TYPE_CHECKING
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from tree_search.transposition_table import TranspositionTable, kNoAction
+from tree_search.batch_evaluator import BatchEvaluator
+if TYPE_CHECKING:
+    from typing import Callable, List, Tuple
+
+# Number of states held for regenerating the frontier states from, see best_first_search
+kDefaultMaxStates = 1 << 16
+
+
+class NodePool:
+    """Search tree nodes stored as parallel arrays instead of node objects.
+    Node i is described by its parent index (-1 for the root), the action taken from its parent as a byte,
+    its path cost and the log probability of its path under the search policy.
+    """
+
+    def __init__(self):
+        self.parent = array("i")
+        self.action = bytearray()
+        self.g = array("d")
+        self.log_pi = array("d")
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def add(self, parent: int, action: int, g: float, log_pi: float = 0.0) -> int:
+        self.parent.append(parent)
+        self.action.append(action)
+        self.g.append(g)
+        self.log_pi.append(log_pi)
+        return len(self.parent) - 1
+
+    def path(self, node: int) -> List[int]:
+        """Get the actions from the root to the node"""
+        actions = []
+        while self.parent[node] >= 0:
+            actions.append(self.action[node])
+            node = self.parent[node]
+        return actions[::-1]
+
+
+class SearchStats:
+    """Counters collected during a search"""
+
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.pruned = 0
+        self.max_frontier = 0
+        self.time = 0.0
+        self.solution_cost = None
+
+    def __repr__(self) -> str:
+        return "expanded: {}, generated: {}, duplicates: {}, pruned: {}, max frontier: {}, time: {:.3f}s, cost: {}".format(
+            self.expanded, self.generated, self.duplicates, self.pruned, self.max_frontier, self.time, self.solution_cost
+        )
+
+
+def _default_heuristic(state) -> float:
+    return state.heuristic_value()
+
+
+def _make_closed_set(table: TranspositionTable = None) -> Tuple[Callable, Callable]:
+    """Get the get_g(key, default=None) and set_g(key, g, parent, action) functions of a closed set, which is
+    a dict keyed by state hash or the transposition table if given"""
+    if table is None:
+        closed = {}
+
+        def set_g(key, g, parent, action):
+            closed[key] = g
+
+        return closed.get, set_g
+
+    def get_g(key, default=None):
+        entry = table.lookup(key)
+        return default if entry is None else entry[0]
+
+    def set_g(key, g, parent, action):
+        table.store(key, g, action, parent, int(g))
+
+    return get_g, set_g
+
+
+class _FunctionEvaluation:
+    """Evaluates nodes as they are generated with a heuristic function, with policies computed on expansion"""
+
+    def __init__(self, heuristic_fn: Callable = None, policy_fn: Callable = None):
+        self._heuristic_fn = heuristic_fn
+        self._policy_fn = policy_fn
+
+    def add(self, node: int, state, push: Callable) -> None:
+        push(node, state, self._heuristic_fn(state) if self._heuristic_fn is not None else 0.0, None)
+
+    def flush(self, push: Callable) -> bool:
+        return False
+
+    def policy(self, state, probs: List[float]) -> List[float]:
+        return self._policy_fn(state) if self._policy_fn is not None else None
+
+    def close(self) -> None:
+        pass
+
+
+class _BatchedEvaluation:
+    """Evaluates nodes in batches with a BatchEvaluator, with policies computed with the heuristic values"""
+
+    def __init__(self, evaluator: BatchEvaluator):
+        self._evaluator = evaluator
+        self._pending = []
+        self._in_flight = None
+
+    def _collect(self, batch: Tuple, push: Callable) -> None:
+        future, nodes = batch
+        values, policies = future.result()
+        for i, (node, state) in enumerate(nodes):
+            push(node, state, values[i] if values is not None else 0.0, policies[i] if policies is not None else None)
+
+    def _submit(self, push: Callable) -> None:
+        # The next batch is filled and queued before taking the previous one, so filling overlaps its evaluation
+        previous = self._in_flight
+        self._in_flight = (self._evaluator.submit([state for _, state in self._pending]), self._pending)
+        self._pending = []
+        if previous is not None:
+            self._collect(previous, push)
+        if not self._evaluator.background:
+            self._collect(self._in_flight, push)
+            self._in_flight = None
+
+    def add(self, node: int, state, push: Callable) -> None:
+        self._pending.append((node, state))
+        if len(self._pending) >= self._evaluator.batch_size:
+            self._submit(push)
+
+    def flush(self, push: Callable) -> bool:
+        """Evaluate the pending or in flight nodes, returning False if there were none"""
+        if len(self._pending) > 0:
+            self._submit(push)
+        elif self._in_flight is not None:
+            self._collect(self._in_flight, push)
+            self._in_flight = None
+        else:
+            return False
+        return True
+
+    def policy(self, state, probs: List[float]) -> List[float]:
+        return probs
+
+    def close(self) -> None:
+        if self._in_flight is not None:
+            self._in_flight[0].result()
+
+
+def _search(
+    root,
+    priority_fn: Callable[[float, float, float], float],
+    evaluation,
+    goal_on_generation: bool,
+    max_expansions: int,
+    time_limit: float,
+    table: TranspositionTable,
+    distinct_successors: bool,
+    prune_dead: bool,
+    max_states: int,
+) -> Tuple[List[int], SearchStats]:
+    """Expansion loop shared by the best-first searches, where evaluation gives the heuristic values and policies.
+    Frontier entries are (priority, node, policy), with states held apart from them and the oldest dropped first.
+    """
+    start_time = time.perf_counter()
+    stats = SearchStats()
+    pool = NodePool()
+    frontier = []
+    states = {}
+    get_g, set_g = _make_closed_set(table)
+
+    def _done(node):
+        evaluation.close()
+        stats.time = time.perf_counter() - start_time
+        if node is None:
+            return None, stats
+        stats.solution_cost = pool.g[node]
+        return pool.path(node), stats
+
+    def _cache(node, state):
+        if max_states is not None and len(states) >= max_states:
+            del states[next(iter(states))]
+        states[node] = state
+
+    def _push(node, state, h, policy):
+        _cache(node, state)
+        heapq.heappush(frontier, (priority_fn(pool.g[node], h, pool.log_pi[node]), node, policy))
+
+    def _state_of(node):
+        state = states.pop(node, None)
+        if state is not None:
+            return state
+        actions = []
+        anchor = node
+        while anchor != root_node and anchor not in states:
+            actions.append(pool.action[anchor])
+            anchor = pool.parent[anchor]
+        state = (root if anchor == root_node else states[anchor]).clone()
+        for action in reversed(actions):
+            state.apply_action(action)
+        return state
+
+    root_node = pool.add(-1, 0, 0.0, 0.0)
+    if goal_on_generation and root.is_solution():
+        return _done(root_node)
+    set_g(hash(root), 0.0, -1, kNoAction)
+    evaluation.add(root_node, root, _push)
+
+    while True:
+        if len(frontier) == 0:
+            if not evaluation.flush(_push):
+                break
+            stats.max_frontier = max(stats.max_frontier, len(frontier))
+            continue
+
+        _, node, probs = heapq.heappop(frontier)
+        g = pool.g[node]
+        state = _state_of(node)
+        if get_g(hash(state), g) < g:  # Stale entry, state was reached again with a lower cost
+            continue
+        if not goal_on_generation and state.is_solution():
+            return _done(node)
+        if max_expansions is not None and stats.expanded >= max_expansions:
+            break
+        if time_limit is not None and time.perf_counter() - start_time > time_limit:
+            break
+
+        stats.expanded += 1
+        if max_states is not None:
+            _cache(node, state)  # Kept to regenerate the states of its children from
+        actions = state.distinct_successors() if distinct_successors else state.successors()
+        probs = evaluation.policy(state, probs)
+        for action in actions:
+            log_pi = pool.log_pi[node]
+            if probs is not None:
+                if probs[action] <= 0:
+                    continue
+                log_pi += math.log(probs[action])
+            child = state.clone()
+            child.apply_action(action)
+            stats.generated += 1
+            child_g = g + 1
+            key = hash(child)
+            closed_g = get_g(key)
+            if closed_g is not None and closed_g <= child_g:
+                stats.duplicates += 1
+                continue
+            if prune_dead and child.is_dead():
+                stats.pruned += 1
+                continue
+            child_node = pool.add(node, action, child_g, log_pi)
+            set_g(key, child_g, node, action)
+            if goal_on_generation and child.is_solution():
+                return _done(child_node)
+            evaluation.add(child_node, child, _push)
+        stats.max_frontier = max(stats.max_frontier, len(frontier))
+
+    return _done(None)
+
+
+def best_first_search(
+    root,
+    priority_fn: Callable[[float, float, float], float],
+    heuristic_fn: Callable = _default_heuristic,
+    policy_fn: Callable = None,
+    goal_on_generation: bool = False,
+    max_expansions: int = None,
+    time_limit: float = None,
+    table: TranspositionTable = None,
+    distinct_successors: bool = False,
+    prune_dead: bool = False,
+    max_states: int = kDefaultMaxStates,
+) -> Tuple[List[int], SearchStats]:
+    """Generic best-first search, which all of the search algorithms in this module are built on.
+
+    Nodes are kept in a NodePool, with at most max_states states held for nodes on the frontier and recently
+    expanded nodes. The state of a frontier node which was dropped is regenerated when it is expanded, by replaying
+    its actions from its nearest ancestor which is still held, or the root. Duplicates are detected with a closed
+    set keyed by the state hash, and a duplicate is only reopened if it is reached with a lower cost. The closed
+    set is a dict unless a transposition table is given, which bounds its memory at the cost of re-expanding states
+    whose entries were evicted.
+
+    Args:
+        root: Starting state, which supports successors, apply_action, clone, is_solution and hash
+        priority_fn: Priority of a node from its (path cost, heuristic value, log path probability), lowest first
+        heuristic_fn: Heuristic value of a state, or None if the priority doesn't need it
+        policy_fn: Probabilities over all actions for a state, or None to not track path probabilities
+        goal_on_generation: Flag to test for solutions when nodes are generated instead of expanded
+        max_expansions: Maximum number of node expansions before giving up
+        time_limit: Maximum seconds to search for before giving up
+        table: Transposition table to use as the closed set, which should be empty
+        distinct_successors: Flag to expand with the state's distinct_successors, skipping actions with the same
+            outcome as the noop action
+        prune_dead: Flag to drop children which can never reach a solution, found with the state's is_dead
+        max_states: Maximum number of states to hold, or None to hold the state of every frontier node
+
+    Returns:
+        The actions from the root to a solution (None if not found) and the search statistics
+    """
+    return _search(
+        root,
+        priority_fn,
+        _FunctionEvaluation(heuristic_fn, policy_fn),
+        goal_on_generation,
+        max_expansions,
+        time_limit,
+        table,
+        distinct_successors,
+        prune_dead,
+        max_states,
+    )
+
+
+def astar(root, heuristic_fn: Callable = _default_heuristic, **kwargs) -> Tuple[List[int], SearchStats]:
+    """A* search, ordering nodes by g + h"""
+    return best_first_search(root, lambda g, h, log_pi: g + h, heuristic_fn, **kwargs)
+
+
+def weighted_astar(
+    root, weight: float, heuristic_fn: Callable = _default_heuristic, **kwargs
+) -> Tuple[List[int], SearchStats]:
+    """Weighted A* search, ordering nodes by g + weight * h"""
+    return best_first_search(root, lambda g, h, log_pi: g + weight * h, heuristic_fn, **kwargs)
+
+
+def gbfs(root, heuristic_fn: Callable = _default_heuristic, **kwargs) -> Tuple[List[int], SearchStats]:
+    """Greedy best-first search, ordering nodes by h"""
+    return best_first_search(root, lambda g, h, log_pi: h, heuristic_fn, goal_on_generation=True, **kwargs)
+
+
+def bfs(root, **kwargs) -> Tuple[List[int], SearchStats]:
+    """Breadth-first search, ordering nodes by depth (ties are broken by generation order)"""
+    return best_first_search(root, lambda g, h, log_pi: g, None, goal_on_generation=True, **kwargs)
+
+
+def levin_ts(root, policy_fn: Callable = None, **kwargs) -> Tuple[List[int], SearchStats]:
+    """Levin tree search, ordering nodes by (depth + 1) / pi(path), where pi is the product of the policy
+    probabilities along the path. The policy defaults to uniform over all actions.
+    """
+    if policy_fn is None:
+        num_actions = root.num_actions()
+        policy_fn = lambda state: [1.0 / num_actions] * num_actions
+    return best_first_search(root, lambda g, h, log_pi: math.log(g + 1) - log_pi, None, policy_fn, **kwargs)
+
+
+def batched_best_first_search(
+    root,
+    priority_fn: Callable[[float, float, float], float],
+    evaluator: BatchEvaluator,
+    goal_on_generation: bool = False,
+    max_expansions: int = None,
+    time_limit: float = None,
+    table: TranspositionTable = None,
+    distinct_successors: bool = False,
+    prune_dead: bool = False,
+    max_states: int = kDefaultMaxStates,
+) -> Tuple[List[int], SearchStats]:
+    """Best-first search where heuristic values and policies come from a batch evaluator.
+
+    Generated nodes wait in a pending batch until the evaluator's batch size is reached, or the frontier runs out,
+    and are then evaluated together and pushed onto the frontier. Each node's policy is kept with it and gives the
+    path probabilities of its children. With a background evaluator, expansion continues while a batch is being
+    evaluated, and once the next batch is full it is filled into the evaluator's second buffer before the first
+    batch is taken, so nodes can be expanded slightly out of order compared to best_first_search.
+
+    Args:
+        root: Starting state, which supports successors, apply_action, clone, is_solution, hash and
+            get_image_representation
+        priority_fn: Priority of a node from its (path cost, heuristic value, log path probability), lowest first
+        evaluator: Evaluator of state observations, the heuristic value is 0 if it doesn't give values and path
+            probabilities aren't tracked if it doesn't give policies
+        goal_on_generation: Flag to test for solutions when nodes are generated instead of expanded
+        max_expansions: Maximum number of node expansions before giving up
+        time_limit: Maximum seconds to search for before giving up
+        table: Transposition table to use as the closed set, which should be empty
+        distinct_successors: Flag to expand with the state's distinct_successors, skipping actions with the same
+            outcome as the noop action
+        prune_dead: Flag to drop children which can never reach a solution, found with the state's is_dead
+        max_states: Maximum number of states to hold, or None to hold the state of every frontier node
+
+    Returns:
+        The actions from the root to a solution (None if not found) and the search statistics
+    """
+    return _search(
+        root,
+        priority_fn,
+        _BatchedEvaluation(evaluator),
+        goal_on_generation,
+        max_expansions,
+        time_limit,
+        table,
+        distinct_successors,
+        prune_dead,
+        max_states,
+    )
+
+
+def batched_weighted_astar(root, evaluator: BatchEvaluator, weight: float = 1.0, **kwargs) -> Tuple[List[int], SearchStats]:
+    """Weighted A* search with heuristic values from a batch evaluator, ordering nodes by g + weight * h"""
+    return batched_best_first_search(root, lambda g, h, log_pi: g + weight * h, evaluator, **kwargs)
+
+
+def batched_levin_ts(root, evaluator: BatchEvaluator, **kwargs) -> Tuple[List[int], SearchStats]:
+    """Levin tree search with policies from a batch evaluator, see levin_ts"""
+    return batched_best_first_search(root, lambda g, h, log_pi: math.log(g + 1) - log_pi, evaluator, **kwargs)
+
+
+def main():
+    from tree_search.rnd_state_py import RNDTreeStatePy
+
+    print("Paste map string: ")
+    sentinel = ""
+    map_str = "\n".join(iter(input, sentinel))
+    for name, search in [("A*", astar), ("GBFS", gbfs), ("BFS", bfs), ("LevinTS", levin_ts)]:
+        actions, stats = search(RNDTreeStatePy(map_str), max_expansions=100000)
+        print("{}: {}".format(name, stats))
+        print("Solution: {}".format(actions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+from array import array
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Tuple
+
+# Eviction policies, used when a state is stored into a full bucket
+kEvictClock = "clock"  # Second chance, entries looked up since the hand last passed them are skipped once
+kEvictLRU = "lru"  # Least recently stored or looked up entry
+kEvictDepth = "depth"  # Deepest entry, keeping states close to the root which the most paths lead back to
+kEvictionPolicies = [kEvictClock, kEvictLRU, kEvictDepth]
+
+kDefaultTableBytes = 1 << 30
+kNoAction = 255
+
+_kKeyMask = (1 << 64) - 1
+# Fibonacci hashing multiplier, the top bits of key * multiplier depend on every bit of the key
+_kBucketMultiplier = 0x9E3779B97F4A7C15
+# Entry flags
+_kEntryUsed = 1
+_kEntryReferenced = 2
+
+
+class TranspositionTable:
+    """Fixed size hash table of compact search entries keyed by the 64-bit state hash.
+
+    Each entry holds a path cost, an action, a parent index and a depth in parallel arrays, with no state objects.
+    The table is split into buckets of a few slots and a state can only be stored in the bucket its hash maps
+    to, so when the bucket is full one of its entries is evicted by the eviction policy. Buckets come from the top
+    bits of a multiplicative mix of the hash, so keys which agree in their low bits, such as the states owned by
+    one HDA* worker, still spread over every bucket. All memory is allocated up front.
+    """
+
+    def __init__(self, max_bytes: int = kDefaultTableBytes, ways: int = 4, policy: str = kEvictClock):
+        """
+        Args:
+            max_bytes: Memory cap of the table
+            ways: Number of slots per bucket
+            policy: Eviction policy, one of kEvictionPolicies
+        """
+        if policy not in kEvictionPolicies:
+            print("Error: unknown eviction policy {}, expected one of {}.".format(policy, kEvictionPolicies))
+            raise ValueError
+        # key, g, action, parent, depth, flags and the bucket hand or lru tick
+        entry_bytes = 8 + 4 + 1 + 4 + 4 + 1 + (8 if policy == kEvictLRU else 1)
+        num_buckets = max_bytes // (entry_bytes * ways)
+        if ways < 1 or num_buckets < 1:
+            print("Error: {} bytes is too small for a table with {} ways.".format(max_bytes, ways))
+            raise ValueError
+        num_buckets = 1 << (num_buckets.bit_length() - 1)
+        size = num_buckets * ways
+
+        self._policy = policy
+        self._ways = ways
+        self._shift = 64 - (num_buckets.bit_length() - 1)
+        self._keys = array("Q", bytes(8 * size))
+        self._g = array("f", bytes(4 * size))
+        self._action = bytearray(size)
+        self._parent = array("i", bytes(4 * size))
+        self._depth = array("I", bytes(4 * size))
+        self._flags = bytearray(size)
+        self._hands = bytearray(num_buckets) if policy == kEvictClock else None
+        self._ticks = array("Q", bytes(8 * size)) if policy == kEvictLRU else None
+        self._tick = 0
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def capacity(self) -> int:
+        """Get the number of entries the table can hold"""
+        return len(self._keys)
+
+    def memory_bytes(self) -> int:
+        """Get the number of bytes allocated for the entries"""
+        buffers = [self._keys, self._g, self._action, self._parent, self._depth, self._flags, self._hands, self._ticks]
+        return sum(len(b) * (b.itemsize if isinstance(b, array) else 1) for b in buffers if b is not None)
+
+    def _bucket(self, key: int) -> int:
+        return ((key * _kBucketMultiplier) & _kKeyMask) >> self._shift
+
+    def _find(self, key: int) -> int:
+        base = self._bucket(key) * self._ways
+        keys, flags = self._keys, self._flags
+        for slot in range(base, base + self._ways):
+            if flags[slot] and keys[slot] == key:
+                return slot
+        return -1
+
+    def _touch(self, slot: int) -> None:
+        if self._policy == kEvictClock:
+            self._flags[slot] = _kEntryUsed | _kEntryReferenced
+        elif self._policy == kEvictLRU:
+            self._tick += 1
+            self._ticks[slot] = self._tick
+
+    def _victim(self, key: int) -> int:
+        """Get the slot to store a new key in, evicting an entry if its bucket is full"""
+        bucket = self._bucket(key)
+        base = bucket * self._ways
+        flags = self._flags
+        for slot in range(base, base + self._ways):
+            if not flags[slot]:
+                self._size += 1
+                return slot
+
+        self.evictions += 1
+        if self._policy == kEvictClock:
+            hand = self._hands[bucket]
+            while flags[base + hand] & _kEntryReferenced:
+                flags[base + hand] = _kEntryUsed
+                hand = (hand + 1) % self._ways
+            self._hands[bucket] = (hand + 1) % self._ways
+            return base + hand
+        if self._policy == kEvictLRU:
+            ticks = self._ticks
+            return min(range(base, base + self._ways), key=ticks.__getitem__)
+        depth = self._depth
+        return max(range(base, base + self._ways), key=depth.__getitem__)
+
+    def lookup(self, key: int) -> Tuple[float, int, int, int]:
+        """Get the (g, action, parent, depth) entry of a state hash, or None if it isn't in the table"""
+        key &= _kKeyMask
+        slot = self._find(key)
+        if slot < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(slot)
+        return self._g[slot], self._action[slot], self._parent[slot], self._depth[slot]
+
+    def store(self, key: int, g: float, action: int = kNoAction, parent: int = -1, depth: int = 0) -> None:
+        """Store the entry of a state hash, replacing any entry it already has
+
+        Args:
+            key: State hash
+            g: Path cost of the state
+            action: Action stored with the state, such as the best action or the action which reached it
+            parent: Index of the parent node, or -1
+            depth: Depth of the state in the search tree
+        """
+        key &= _kKeyMask
+        slot = self._find(key)
+        if slot < 0:
+            slot = self._victim(key)
+            self._keys[slot] = key
+        self._g[slot] = g
+        self._action[slot] = action
+        self._parent[slot] = parent
+        self._depth[slot] = depth
+        self._flags[slot] = _kEntryUsed
+        self._touch(slot)
+
+    def __contains__(self, key: int) -> bool:
+        return self._find(key & _kKeyMask) >= 0
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters"""
+        self._flags[:] = bytes(len(self._flags))
+        self._size = 0
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        lookups = self.hits + self.misses
+        return "entries: {}/{}, hits: {}, misses: {}, hit rate: {:.3f}, evictions: {}".format(
+            self._size, self.capacity(), self.hits, self.misses, self.hits / lookups if lookups > 0 else 0.0,
+            self.evictions,
+        )
@@ -0,0 +1,69 @@
+"""
+Benchmark how HDA* scales with the number of worker processes.
+The default map is a generated 24x24 gem_key_exit map, the same search is run once for each worker count.
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from env_factory.gem_key_exit import create_gem_key_exit
+from tree_search.rnd_state_py import RNDTreeStatePy
+from tree_search.hda_star import hda_star
+
+
+def benchmark(map_str: str, worker_counts: list, weight: float, time_limit: float, max_expansions: int) -> None:
+    # Speedup is in time to finish the search, throughput in expansions per second
+    print("{:>8} {:>10} {:>10} {:>12} {:>8} {:>11} {:>6}".format(
+        "workers", "time (s)", "expanded", "expanded/s", "speedup", "throughput", "cost"
+    ))
+    base_time, base_rate = None, None
+    for num_workers in worker_counts:
+        actions, stats = hda_star(
+            RNDTreeStatePy(map_str), num_workers, weight=weight, max_expansions=max_expansions, time_limit=time_limit
+        )
+        rate = stats.expanded / stats.time
+        if base_time is None:
+            base_time, base_rate = stats.time, rate
+        print("{:>8} {:>10.3f} {:>10} {:>12.0f} {:>8.2f} {:>11.2f} {:>6}".format(
+            num_workers,
+            stats.time,
+            stats.expanded,
+            rate,
+            base_time / stats.time,
+            rate / base_rate,
+            "-" if actions is None else stats.solution_cost,
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_path", help="Path to map string file, generated if not given", required=False, type=str, default=None)
+    parser.add_argument("--workers", help="Worker counts to run", required=False, type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--weight", help="Heuristic weight", required=False, type=float, default=1.0)
+    parser.add_argument("--time_limit", help="Seconds per search", required=False, type=float, default=300)
+    parser.add_argument("--max_expansions", help="Expansions per search", required=False, type=int, default=None)
+    parser.add_argument("--seed", help="Seed of the generated map", required=False, type=int, default=0)
+    parser.add_argument("--num_gems", help="Gems in the generated map", required=False, type=int, default=4)
+    parser.add_argument("--num_rooms", help="Rooms in the generated map", required=False, type=int, default=2)
+    parser.add_argument("--num_locked_doors", help="Locked doors in the generated map", required=False, type=int, default=1)
+    args = parser.parse_args()
+
+    if args.map_path is not None:
+        with open(args.map_path, "r") as file:
+            map_str = file.read().strip()
+    else:
+        map_str = create_gem_key_exit(
+            size=24,
+            num_gems=args.num_gems,
+            seed=args.seed,
+            num_rooms=args.num_rooms,
+            num_locked_doors=args.num_locked_doors,
+            ratio_gems_in_room=0.5,
+        )
+    print("Logical CPUs: {}".format(os.cpu_count()))
+    benchmark(map_str, args.workers, args.weight, args.time_limit, args.max_expansions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark the L1 heuristic of RNDGameState against the distance field heuristic.
+A* and GBFS are run on generated gem_exit maps and on gem_key_exit maps with and without gems, and the
+expansions of each search are printed, counting a search which gives up as max_expansions.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from env_factory.gem_exit import create_env_gem_exit
+from env_factory.gem_key_exit import create_gem_key_exit
+from tree_search.rnd_state_py import RNDTreeStatePy
+from tree_search.search import astar, gbfs
+
+
+def generate_maps(num_seeds: int) -> list:
+    maps = []
+    for num_gems in [2, 3]:
+        for seed in range(num_seeds):
+            maps.append(("gem_exit {} gems, seed {}".format(num_gems, seed), create_env_gem_exit(size=10, num_gems=num_gems, seed=seed)))
+    for num_gems in [0, 2]:
+        for seed in range(num_seeds):
+            map_str = create_gem_key_exit(
+                size=14, num_gems=num_gems, seed=seed, num_rooms=2, room_size=5, num_locked_doors=1, ratio_gems_in_room=0.5
+            )
+            maps.append(("gem_key_exit {} gems, seed {}".format(num_gems, seed), map_str))
+    return maps
+
+
+def benchmark(maps: list, search, max_expansions: int, time_limit: float) -> None:
+    totals = {False: 0, True: 0}
+    for name, map_str in maps:
+        results = []
+        for use_distance_heuristic in [False, True]:
+            start = time.perf_counter()
+            actions, stats = search(
+                RNDTreeStatePy(map_str, use_distance_heuristic=use_distance_heuristic),
+                max_expansions=max_expansions,
+                time_limit=time_limit,
+            )
+            duration = time.perf_counter() - start
+            totals[use_distance_heuristic] += stats.expanded if actions is not None else max_expansions
+            results.append("{:>6} {} {:.2f}s".format(stats.expanded, "solved" if actions is not None else "failed", duration))
+        print("{:<28} L1: {} | distance: {}".format(name, *results))
+    print("Total expansions, L1: {}, distance: {}".format(totals[False], totals[True]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search", help="Search to run", required=False, type=str, default="astar", choices=["astar", "gbfs"])
+    parser.add_argument("--num_seeds", help="Maps generated per map type", required=False, type=int, default=8)
+    parser.add_argument("--max_expansions", help="Expansions per search", required=False, type=int, default=20000)
+    parser.add_argument("--time_limit", help="Seconds per search", required=False, type=float, default=20)
+    args = parser.parse_args()
+
+    search = astar if args.search == "astar" else gbfs
+    benchmark(generate_maps(args.num_seeds), search, args.max_expansions, args.time_limit)
+
+
+if __name__ == "__main__":
+    main()
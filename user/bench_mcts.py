@@ -0,0 +1,54 @@
+"""
+Benchmark MCTS rollouts per second on the example maps.
+Each map is searched from its start with random rollouts, single process or root parallel over several workers.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game import RNDGameState
+from tree_search.mcts import MCTS, root_parallel_search
+
+kDefaultMapPath = os.path.join(os.path.dirname(__file__), "example_map_str.txt")
+
+
+def benchmark(map_str: str, num_simulations: int, rollout_depth: int, num_workers: int) -> None:
+    state = RNDGameState({"grid": map_str})
+    start = time.perf_counter()
+    if num_workers > 1:
+        _, _, num_rollouts, num_steps = root_parallel_search(
+            state, num_workers, num_simulations=num_simulations // num_workers, rollout_depth=rollout_depth
+        )
+    else:
+        mcts = MCTS(state, rollout_depth=rollout_depth)
+        mcts.search(num_simulations=num_simulations)
+        num_rollouts, num_steps = mcts.num_simulations, mcts.num_steps
+    duration = time.perf_counter() - start
+    print("{:>10} {:>10.3f} {:>12.0f} {:>12.0f}".format(
+        num_rollouts, duration, num_rollouts / duration, num_steps / duration
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_path", help="Path to file of map strings separated by blank lines", required=False, type=str, default=kDefaultMapPath)
+    parser.add_argument("--num_simulations", help="Simulations per map", required=False, type=int, default=2000)
+    parser.add_argument("--rollout_depth", help="Maximum steps per rollout", required=False, type=int, default=50)
+    parser.add_argument("--num_workers", help="Root parallel worker processes", required=False, type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.map_path, "r") as file:
+        map_strs = [map_str.strip() for map_str in file.read().split("\n\n") if map_str.strip()]
+    print("{:>4} {:>10} {:>10} {:>12} {:>12}".format("map", "rollouts", "time (s)", "rollouts/s", "steps/s"))
+    for i, map_str in enumerate(map_strs):
+        print("{:>4} ".format(i), end="")
+        try:
+            benchmark(map_str, args.num_simulations, args.rollout_depth, args.num_workers)
+        except ValueError:
+            print("skipped, map could not be loaded")
+
+
+if __name__ == "__main__":
+    main()
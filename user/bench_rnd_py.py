@@ -0,0 +1,88 @@
+"""
+Benchmark stepping the python engine on a map file.
+The default map is a large field of bombs, butterflies and fireflies which is set off in one chain reaction
+by a falling stone on the first step.
+With --batch_size, B scalar states stepped one by one are also compared against a BatchedRNDGameState of B copies
+of the map, both producing stacked observations each step.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game import RNDGameState, BatchedRNDGameState
+
+kDefaultMapPath = os.path.join(os.path.dirname(__file__), "chain_explosion_map_str.txt")
+
+
+def benchmark(map_str: str, num_steps: int, num_repeats: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    first_step_times = []
+    step_times = []
+    for _ in range(num_repeats):
+        state = RNDGameState({"grid": map_str})
+        actions = rng.integers(0, 5, size=num_steps).tolist()
+        for i, action in enumerate(actions):
+            if state.is_terminal():
+                break
+            start = time.perf_counter()
+            state.apply_action(action)
+            duration = time.perf_counter() - start
+            (first_step_times if i == 0 else step_times).append(duration)
+
+    print("First step : {:.3f}ms".format(np.mean(first_step_times) * 1e3))
+    if len(step_times) > 0:
+        print("Time per step : {:.3f}ms ({} steps)".format(np.mean(step_times) * 1e3, len(step_times)))
+
+
+def benchmark_batch(map_str: str, batch_size: int, num_steps: int, num_repeats: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    scalar_times = []
+    batch_times = []
+    for _ in range(num_repeats):
+        actions = rng.integers(0, 5, size=(num_steps, batch_size))
+        params = [{"grid": map_str, "rng_seed": b} for b in range(batch_size)]
+
+        states = [RNDGameState(dict(p)) for p in params]
+        observations = np.empty((batch_size,) + states[0].observation_shape(), dtype=np.float32)
+        start = time.perf_counter()
+        for step_actions in actions.tolist():
+            for b, (state, action) in enumerate(zip(states, step_actions)):
+                if not state.is_terminal():
+                    state.apply_action(action)
+                state.get_observation(out=observations[b])
+        scalar_times.append((time.perf_counter() - start) / num_steps)
+
+        batch = BatchedRNDGameState([dict(p) for p in params])
+        observations = np.empty(batch.observation_shape(), dtype=np.float32)
+        start = time.perf_counter()
+        for step_actions in actions:
+            batch.apply_actions(step_actions)
+            batch.get_observations(out=observations)
+        batch_times.append((time.perf_counter() - start) / num_steps)
+
+    scalar_time, batch_time = np.mean(scalar_times), np.mean(batch_times)
+    print("Batch of {}, {} scalar states : {:.3f}ms per step".format(batch_size, batch_size, scalar_time * 1e3))
+    print("Batch of {}, BatchedRNDGameState : {:.3f}ms per step".format(batch_size, batch_time * 1e3))
+    print("Speedup : {:.2f}x".format(scalar_time / batch_time))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_path", help="Path to map string file", required=False, type=str, default=kDefaultMapPath)
+    parser.add_argument("--num_steps", help="Number of random steps per repeat", required=False, type=int, default=100)
+    parser.add_argument("--num_repeats", help="Number of times to replay the map", required=False, type=int, default=10)
+    parser.add_argument("--batch_size", help="Batch size to compare against scalar states, 0 to skip", required=False, type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.map_path, "r") as file:
+        map_str = file.read().strip()
+    benchmark(map_str, args.num_steps, args.num_repeats)
+    if args.batch_size > 0:
+        benchmark_batch(map_str, args.batch_size, args.num_steps, args.num_repeats)
+
+
+if __name__ == "__main__":
+    main()
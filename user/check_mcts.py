@@ -0,0 +1,47 @@
+"""
+Regression checks for MCTS value backup and selection.
+On a map where moving left enters the open exit, both UCT and PUCT must credit the scoring step to its action,
+and UCT must still explore the other actions although the exit reward is large in points.
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rnd_py.rnd_game import RNDGameState
+from rnd_py.rnd_game_util import kDirLeft
+from tree_search.mcts import MCTS
+
+kExitMapStr = "\n".join([
+    "5|3|50|0",
+    "19|19|19|19|19",
+    "19|08|00|01|19",
+    "19|19|19|19|19",
+])
+
+
+def check_exit_map(use_puct: bool) -> None:
+    mcts = MCTS(RNDGameState({"grid": kExitMapStr}), use_puct=use_puct, rollout_depth=10)
+    mcts.search(num_simulations=200)
+    stats = mcts.root_stats()
+    visits, value_sum = stats[kDirLeft]
+    assert mcts.best_action() == kDirLeft, "use_puct={}: chose {}, root stats {}".format(use_puct, mcts.best_action(), stats)
+    assert value_sum / visits > 0, "use_puct={}: exit action has no value, root stats {}".format(use_puct, stats)
+
+
+def check_uct_explores(num_simulations: int = 200) -> None:
+    mcts = MCTS(RNDGameState({"grid": kExitMapStr}), rollout_depth=10)
+    mcts.search(num_simulations=num_simulations)
+    stats = mcts.root_stats()
+    min_visits = min(visits for visits, _ in stats.values())
+    assert min_visits >= num_simulations // 20, "UCT stopped exploring, root stats {}".format(stats)
+
+
+def main():
+    for use_puct in [False, True]:
+        check_exit_map(use_puct)
+    check_uct_explores()
+    print("MCTS checks passed")
+
+
+if __name__ == "__main__":
+    main()
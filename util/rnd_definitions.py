@@ -434,12 +434,9 @@ def hiddencell_to_mapstr(map_ids: np.ndarray, max_steps: int, num_diamonds: int
         string representing map in OpenSpiel format
     """
     rows, cols = map_ids.shape
-    map_str = "{},{},{},{}\n".format(rows, cols, max_steps, num_diamonds)
-    for r in range(rows):
-        for c in range(cols):
-            map_str += "{},".format(map_ids[r, c])
-        map_str = map_str[:-1] + "\n"
-    return map_str[:-1]
+    lines = ["{},{},{},{}".format(rows, cols, max_steps, num_diamonds)]
+    lines += [",".join([str(tile) for tile in row]) for row in np.asarray(map_ids).tolist()]
+    return "\n".join(lines)
 
 
 def create_path_key(start_cell, goal_cell, key_red, door_red, key_yellow, door_yellow):
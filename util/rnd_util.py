@@ -235,12 +235,9 @@ def create_empty_map(
 
 def map_to_str(m, max_steps: int, num_gems: int) -> str:
     rows, cols = m.shape[0], m.shape[1]
-    output_str = "{}|{}|{}|{}\n".format(rows, cols, max_steps, num_gems)
-    for r in range(rows):
-        for c in range(cols):
-            output_str += "{:02d}|".format(m[r, c])
-        output_str = output_str[:-1] + "\n"
-    return output_str[:-1]
+    lines = ["{}|{}|{}|{}".format(rows, cols, max_steps, num_gems)]
+    lines += ["|".join(["{:02d}".format(tile) for tile in row]) for row in np.asarray(m).tolist()]
+    return "\n".join(lines)
 
 
 def flatten_map_str(map_str: str) -> str: